@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import shutil
+import tempfile
+from urllib.parse import urlparse
+
+from .cli import docker_argv
+from .compose import PROJECT_LABEL, STACK_ACTIONS, dependency_levels
+from .registry import DOCKER_HUB_REGISTRY, parse_image_reference
+
+logger = logging.getLogger(__name__)
+
+COMMAND_TIMEOUT = 600
+# Pulls of large images legitimately run for a long time
+PULL_TIMEOUT = None
+CONTAINER_ACTIONS = {
+    'start': ['start'],
+    'stop': ['stop'],
+    'restart': ['restart'],
+    'remove': ['rm', '--force'],
+}
+DOCKER_HUB_AUTH_KEY = 'https://index.docker.io/v1/'
+
+# Detached tasks, referenced until they finish so they are not garbage collected
+_detached = set()
+
+
+class CommandError(Exception):
+    def __init__(self, args, returncode, output):
+        self.returncode = returncode
+        self.output = output
+        super().__init__(f"{' '.join(args[:3])} failed ({returncode}): {output}")
+
+
+class Container:
+    """The parts of a container object the compose helpers need, built from `docker inspect`."""
+
+    def __init__(self, attrs):
+        self.attrs = attrs
+        self.id = attrs.get('Id')
+        self.name = (attrs.get('Name') or '').lstrip('/')
+
+
+async def run(args, timeout=COMMAND_TIMEOUT, env=None, merge_stderr=False):
+    """Runs a command without blocking the event loop and returns its stdout.
+
+    With `merge_stderr` both streams are returned interleaved, the way the
+    daemon hands out container logs.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE,
+        env=env,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except BaseException:
+        # Timed out, or the client went away and the view was cancelled
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode:
+        output = (stdout if merge_stderr else stderr) or b''
+        raise CommandError(args, process.returncode, output.decode(errors='replace').strip())
+    return stdout
+
+
+async def docker(*args, **kwargs):
+    return await run(docker_argv(*args), **kwargs)
+
+
+def _log_orphaned(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Detached docker operation failed: {task.exception()}")
+
+
+async def detached(coro):
+    """Awaits `coro` in a task of its own that outlives the caller.
+
+    Under ASGI Django cancels a view when its client disconnects, and `run`
+    kills the command it is waiting on. State-changing operations (pulls,
+    container recreation) go through here so a closed tab or a proxy timeout
+    cannot stop them halfway; the view stops waiting but the task finishes
+    and logs its failure.
+    """
+    task = asyncio.ensure_future(coro)
+    _detached.add(task)
+    task.add_done_callback(_detached.discard)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if not task.done():
+            task.add_done_callback(_log_orphaned)
+        raise
+
+
+async def container_action(container_id, action):
+    if action not in CONTAINER_ACTIONS:
+        raise ValueError(f"Unsupported container action: {action}")
+    await docker(*CONTAINER_ACTIONS[action], container_id)
+
+
+async def container_logs(container_id, tail=None):
+    args = ['logs']
+    if tail:
+        args += ['--tail', str(tail)]
+    return await docker(*args, container_id, merge_stderr=True)
+
+
+async def project_containers(project):
+    ids = (await docker('ps', '--all', '--quiet', '--filter', f"label={PROJECT_LABEL}={project}")).split()
+    if not ids:
+        return []
+    return [Container(attrs) for attrs in json.loads(await docker('inspect', *[i.decode() for i in ids]))]
+
+
+async def stack_action(containers, action):
+    """Async counterpart of compose.stack_action: one level at a time, each level concurrently."""
+    if action not in STACK_ACTIONS:
+        raise ValueError(f"Unsupported stack action: {action}")
+    levels = dependency_levels(containers)
+    if action == 'stop':
+        levels.reverse()
+
+    errors = {}
+    for level in levels:
+        results = await asyncio.gather(*(container_action(c.id, action) for c in level), return_exceptions=True)
+        for container, result in zip(level, results):
+            if isinstance(result, Exception):
+                logger.error(f"Stack {action} failed for {container.name}: {result}")
+                errors[container.name] = str(result)
+    return errors
+
+
+def _auth_key(image):
+    base_url = parse_image_reference(image)[0]
+    return DOCKER_HUB_AUTH_KEY if base_url == DOCKER_HUB_REGISTRY else urlparse(base_url).netloc
+
+
+async def pull(image, auth_config=None):
+    """Pulls an image; credentials go into a throwaway config dir so they never touch ~/.docker.
+
+    The dir is passed with --config rather than DOCKER_CONFIG, which sudo
+    would strip from the environment.
+    """
+    if not auth_config:
+        return await docker('pull', image, timeout=PULL_TIMEOUT)
+    config_dir = tempfile.mkdtemp(prefix='docker-auth-')
+    try:
+        token = base64.b64encode(f"{auth_config['username']}:{auth_config['password']}".encode()).decode()
+        path = os.path.join(config_dir, 'config.json')
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), 'w') as f:
+            json.dump({'auths': {_auth_key(image): {'auth': token}}}, f)
+        return await docker('--config', config_dir, 'pull', image, timeout=PULL_TIMEOUT)
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
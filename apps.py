@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
+
+
+def _start_workers(**kwargs):
+    from . import jobs
+    jobs.start_workers()
+
 
 class DockerConfig(AppConfig):
     name = 'modules.docker'
     label = 'docker_module'
     verbose_name = 'Docker Module'
+
+    def ready(self):
+        # The workers normally run in `manage.py docker_worker`. Loading the app
+        # (tests, scripts, other commands) never starts them; with the opt-in
+        # setting the web server starts them when it handles a request.
+        if getattr(settings, 'DOCKER_IN_PROCESS_WORKERS', False):
+            request_started.connect(_start_workers, dispatch_uid='docker_start_workers')
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import streams
+from .streams import TransferProgress
+from .storage import data_dir
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 3
+BACKUP_KINDS = ('backup', 'restore')
+BACKUP_SUFFIX = '.tar.gz'
+# Docker's own rule for volume names; anything else (e.g. a path) would become a bind mount
+VOLUME_NAME = re.compile(r'[a-zA-Z0-9][a-zA-Z0-9_.-]*')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='docker-backup')
+
+
+def helper_image():
+    """Image used to read and write volume contents; it only needs a tar binary."""
+    return getattr(settings, 'DOCKER_BACKUP_IMAGE', 'busybox:latest')
+
+
+def backup_dir():
+    return data_dir('backups')
+
+
+def backup_path(filename):
+    """Resolves a backup file name, refusing anything outside the backup directory."""
+    filename = os.path.basename(filename or '')
+    if not filename.endswith(BACKUP_SUFFIX):
+        raise ValueError(f"Not a backup file: {filename}")
+    path = os.path.join(backup_dir(), filename)
+    if not os.path.isfile(path):
+        raise ValueError(f"Backup not found: {filename}")
+    return path
+
+
+def list_backups():
+    directory = backup_dir()
+    backups = []
+    for filename in sorted(os.listdir(directory), reverse=True):
+        if not filename.endswith(BACKUP_SUFFIX):
+            continue
+        path = os.path.join(directory, filename)
+        checksum = None
+        if os.path.exists(path + '.sha256'):
+            with open(path + '.sha256') as f:
+                checksum = f.read().split()[0]
+        backups.append({'name': filename, 'size': os.path.getsize(path), 'sha256': checksum, 'created': os.path.getmtime(path)})
+    return backups
+
+
+def volume_mount(volume, mode='rw'):
+    """The -v argument mounting a named volume at /volume, refusing anything that is not a volume name."""
+    if not VOLUME_NAME.fullmatch(volume or ''):
+        raise ValueError(f"Invalid volume name: {volume}")
+    return f"{volume}:/volume:{mode}"
+
+
+def _backup_args(volume):
+    return ['run', '--rm', '-v', volume_mount(volume, 'ro'), helper_image(), 'tar', '-C', '/volume', '-cf', '-', '.']
+
+
+def _restore_args(volume):
+    return ['run', '--rm', '-i', '-v', volume_mount(volume), helper_image(), 'tar', '-C', '/volume', '-xzf', '-']
+
+
+def stream_backup(volume, progress=None, checksum=None):
+    """Yields a gzip-compressed tar of the volume, reading it through a throwaway container."""
+    process = streams.docker_popen(_backup_args(volume))
+    chunks = streams.gzip_chunks(streams.iter_process(process, f"Backup of volume {volume}"))
+    for chunk in chunks:
+        if checksum is not None:
+            checksum.update(chunk)
+        if progress is not None:
+            progress.advance(len(chunk))
+        yield chunk
+    if process.returncode:
+        raise IOError(f"Backup of volume {volume} failed")
+
+
+async def _finish_download(chunks, progress):
+    checksum = hashlib.sha256()
+    await progress.aupdate(state='running')
+    try:
+        async for chunk in progress.atrack(chunks):
+            checksum.update(chunk)
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        await progress.aupdate(state='error', error='Download cancelled', finished=time.time())
+        raise
+    except Exception as e:
+        await progress.aupdate(state='error', error=str(e), finished=time.time())
+        raise
+    await progress.aupdate(state='done', sha256=checksum.hexdigest(), finished=time.time())
+
+
+def download_output(volume, progress):
+    """A backup streamed to the client; its progress record is finished whichever way the download ends."""
+    output = streams.ProcessOutput(_backup_args(volume), f"Backup of volume {volume}")
+    return output.pipe(streams.agzip_chunks).pipe(_finish_download, progress)
+
+
+def backup_to_file(volume, progress):
+    """Writes a backup into the backup directory with a .sha256 file next to it."""
+    filename = f"{volume}-{time.strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}"
+    path = os.path.join(backup_dir(), filename)
+    checksum = hashlib.sha256()
+    progress.update(state='running', file=filename)
+    try:
+        with open(path + '.part', 'wb') as f:
+            for chunk in stream_backup(volume, progress, checksum):
+                f.write(chunk)
+        os.replace(path + '.part', path)
+        with open(path + '.sha256', 'w') as f:
+            f.write(f"{checksum.hexdigest()}  {filename}\n")
+        progress.update(state='done', sha256=checksum.hexdigest(), finished=time.time())
+    except Exception as e:
+        logger.error(f"Backup of volume {volume} failed: {e}")
+        if os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+        progress.update(state='error', error=str(e), finished=time.time())
+
+
+def restore_stream(volume, chunks, progress):
+    """Extracts a gzip-compressed tar stream into the volume and returns its sha256."""
+    checksum = hashlib.sha256()
+
+    def hashed():
+        for chunk in progress.track(chunks):
+            checksum.update(chunk)
+            yield chunk
+
+    process = streams.docker_popen(_restore_args(volume), stdin=True)
+    progress.update(state='running')
+    returncode, output = streams.pipe_to_process(process, hashed(), f"Restore of volume {volume}")
+    if returncode:
+        progress.update(state='error', error=output or 'tar failed', finished=time.time())
+        raise IOError(output or f"Restore of volume {volume} failed")
+    progress.update(state='done', sha256=checksum.hexdigest(), finished=time.time())
+    return checksum.hexdigest()
+
+
+async def arestore_stream(volume, chunks, progress):
+    """Async counterpart of restore_stream for uploads received over ASGI."""
+    checksum = hashlib.sha256()
+
+    async def hashed():
+        async for chunk in progress.atrack(chunks):
+            checksum.update(chunk)
+            yield chunk
+
+    await progress.aupdate(state='running')
+    try:
+        returncode, output = await streams.apipe(_restore_args(volume), hashed(), f"Restore of volume {volume}")
+    except IOError as e:
+        await progress.aupdate(state='error', error=str(e), finished=time.time())
+        raise
+    if returncode:
+        await progress.aupdate(state='error', error=output or 'tar failed', finished=time.time())
+        raise IOError(output or f"Restore of volume {volume} failed")
+    await progress.aupdate(state='done', sha256=checksum.hexdigest(), finished=time.time())
+    return checksum.hexdigest()
+
+
+def restore_from_file(volume, filename, progress):
+    try:
+        path = backup_path(filename)
+        progress.update(file=os.path.basename(path))
+        if os.path.exists(path + '.sha256'):
+            # Verify before touching the volume; a partial restore cannot be undone
+            with open(path + '.sha256') as f:
+                expected = f.read().split()[0]
+            checksum = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(streams.CHUNK_SIZE), b''):
+                    checksum.update(chunk)
+            if checksum.hexdigest() != expected:
+                raise IOError(f"Checksum mismatch for {filename}")
+        with open(path, 'rb') as f:
+            restore_stream(volume, iter(lambda: f.read(streams.CHUNK_SIZE), b''), progress)
+    except Exception as e:
+        logger.error(f"Restore of volume {volume} failed: {e}")
+        progress.update(state='error', error=str(e), finished=time.time())
+
+
+def list_jobs():
+    return streams.list_transfers(BACKUP_KINDS)
+
+
+def submit_backup(volume):
+    progress = TransferProgress('backup', volume)
+    _executor.submit(backup_to_file, volume, progress)
+    return progress.job_id
+
+
+def submit_restore(volume, filename):
+    progress = TransferProgress('restore', volume)
+    _executor.submit(restore_from_file, volume, filename, progress)
+    return progress.job_id
@@ -0,0 +1,20 @@
+import os
+
+from django.conf import settings
+
+
+def docker_cli():
+    """The command prefix used to run the docker CLI directly.
+
+    Like the core CLI wrapper, docker runs through sudo unless the server is
+    already root; `-n` makes a missing sudoers rule fail instead of prompting.
+    Set DOCKER_CLI (e.g. ['docker'] for a user in the docker group) to override.
+    """
+    configured = getattr(settings, 'DOCKER_CLI', None)
+    if configured:
+        return list(configured)
+    return ['docker'] if os.geteuid() == 0 else ['sudo', '-n', 'docker']
+
+
+def docker_argv(*args):
+    return [*docker_cli(), *args]
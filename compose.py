@@ -0,0 +1,67 @@
+PROJECT_LABEL = 'com.docker.compose.project'
+SERVICE_LABEL = 'com.docker.compose.service'
+DEPENDS_ON_LABEL = 'com.docker.compose.depends_on'
+STACK_ACTIONS = ('start', 'stop', 'restart')
+
+
+def _labels(container):
+    return (container.attrs.get('Config') or {}).get('Labels') or {}
+
+
+def project_of(container):
+    return _labels(container).get(PROJECT_LABEL)
+
+
+def group_by_project(containers):
+    """Splits a container snapshot into compose projects and standalone containers in one pass."""
+    projects = {}
+    standalone = []
+    for container in containers:
+        project = project_of(container)
+        if project:
+            projects.setdefault(project, []).append(container)
+        else:
+            standalone.append(container)
+
+    grouped = []
+    for name in sorted(projects):
+        members = sorted(projects[name], key=lambda c: (_labels(c).get(SERVICE_LABEL) or '', c.name))
+        grouped.append({
+            'name': name,
+            'containers': members,
+            'running': sum(1 for c in members if c.status == 'running'),
+        })
+    return grouped, standalone
+
+
+def dependency_levels(containers):
+    """Orders containers into levels where each level only depends on earlier ones.
+
+    Dependencies come from the depends_on label written by Compose v2
+    ("db:service_healthy:false,cache:service_started:false"). Services of a
+    cycle or with no usable labels end up in the same level.
+    """
+    by_service = {}
+    for container in containers:
+        by_service.setdefault(_labels(container).get(SERVICE_LABEL) or container.name, []).append(container)
+
+    depends = {}
+    for service, members in by_service.items():
+        raw = _labels(members[0]).get(DEPENDS_ON_LABEL) or ''
+        deps = {item.split(':', 1)[0].strip() for item in raw.split(',') if item.strip()}
+        depends[service] = deps & set(by_service) - {service}
+
+    levels = []
+    remaining = dict(depends)
+    done = set()
+    while remaining:
+        ready = sorted(s for s, deps in remaining.items() if deps <= done)
+        if not ready:
+            # Dependency cycle: run whatever is left together
+            ready = sorted(remaining)
+        levels.append([c for s in ready for c in by_service[s]])
+        done.update(ready)
+        for service in ready:
+            del remaining[service]
+    return levels
+
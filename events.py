@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import select
+import subprocess
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .cli import docker_argv
+from .models import DockerEvent
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 2
+RETENTION_DAYS = 30
+RETENTION_CHECK_INTERVAL = 3600
+DELETE_BATCH_SIZE = 10000
+PAGE_SIZE = 50
+EVENT_TYPES = ('container', 'image', 'volume', 'network', 'daemon', 'plugin')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# With a shared cache only one worker reads the stream, holding this lease while
+# running; consumers that cannot see each other's lease still store each event once
+LEASE_KEY = 'docker_events_consumer'
+LEASE_TTL = 60
+RESTART_DELAY = 10
+
+
+def parse_event(line):
+    """Turns one line of `docker events --format '{{json .}}'` into an unsaved DockerEvent."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if 'timeNano' in data:
+        event_time = EPOCH + timedelta(microseconds=int(data['timeNano']) // 1000)
+    else:
+        event_time = EPOCH + timedelta(seconds=int(data.get('time', 0)))
+    actor = data.get('Actor') or {}
+    attributes = actor.get('Attributes') or {}
+    return DockerEvent(
+        time=event_time,
+        type=(data.get('Type') or '')[:32],
+        action=(data.get('Action') or data.get('status') or '')[:64],
+        actor_id=(actor.get('ID') or data.get('id') or '')[:128],
+        actor_name=(attributes.get('name') or '')[:255],
+        attributes=attributes,
+    )
+
+
+class EventBuffer:
+    """Collects parsed events and writes them with bulk inserts.
+
+    Events already stored, by an earlier run replaying its last second or by
+    another consumer, are skipped by the unique constraint on DockerEvent.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.last_flush = time.monotonic()
+
+    def add(self, line):
+        event = parse_event(line)
+        if event is not None:
+            self.events.append(event)
+
+    @property
+    def due(self):
+        return len(self.events) >= BATCH_SIZE or (self.events and time.monotonic() - self.last_flush >= FLUSH_INTERVAL)
+
+    def flush(self):
+        if self.events:
+            DockerEvent.objects.bulk_create(self.events, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            self.events = []
+        self.last_flush = time.monotonic()
+
+
+def apply_retention(days=RETENTION_DAYS):
+    """Deletes events older than `days` in batches so no single statement locks the table for long."""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(DockerEvent.objects.filter(time__lt=cutoff).order_by('time').values_list('id', flat=True)[:DELETE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += DockerEvent.objects.filter(id__in=ids).delete()[0]
+
+
+def consume():
+    """Streams `docker events` into the database until the stream ends or the lease is lost."""
+    token = uuid.uuid4().hex
+    if not cache.add(LEASE_KEY, token, LEASE_TTL):
+        return
+
+    last = DockerEvent.objects.order_by('-time').values_list('time', flat=True).first()
+    cmd = docker_argv('events', '--format', '{{json .}}')
+    if last:
+        cmd += ['--since', f"{last.timestamp():.6f}"]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    buffer = EventBuffer()
+    pending = b''
+    next_retention = 0
+    try:
+        while cache.get(LEASE_KEY) == token:
+            cache.set(LEASE_KEY, token, LEASE_TTL)
+            r, w, e = select.select([process.stdout], [], [], 1)
+            if process.stdout in r:
+                data = os.read(process.stdout.fileno(), 65536)
+                if not data:
+                    logger.warning("docker events stream closed")
+                    break
+                *lines, pending = (pending + data).split(b'\n')
+                for line in lines:
+                    buffer.add(line)
+            if buffer.due:
+                buffer.flush()
+            if time.monotonic() >= next_retention:
+                apply_retention()
+                next_retention = time.monotonic() + RETENTION_CHECK_INTERVAL
+    finally:
+        buffer.flush()
+        if process.poll() is None:
+            process.terminate()
+        if cache.get(LEASE_KEY) == token:
+            cache.delete(LEASE_KEY)
+
+
+def encode_cursor(event):
+    return f"{(event.time - EPOCH) // timedelta(microseconds=1)}-{event.id}"
+
+
+def timeline(container=None, type=None, action=None, cursor=None, limit=PAGE_SIZE):
+    """Returns one page of events, newest first, and the cursor of the next page.
+
+    Paging is keyset based on (time, id), so deep pages cost the same as the
+    first one.
+    """
+    events = DockerEvent.objects.all()
+    if container:
+        events = events.filter(Q(actor_id=container) | Q(actor_name=container))
+    if type:
+        events = events.filter(type=type)
+    if action:
+        events = events.filter(action=action)
+    if cursor:
+        try:
+            micros, event_id = (int(part) for part in cursor.split('-', 1))
+        except ValueError:
+            micros = None
+        if micros is not None:
+            before = EPOCH + timedelta(microseconds=micros)
+            events = events.filter(Q(time__lt=before) | Q(time=before, id__lt=event_id))
+
+    page = list(events.order_by('-time', '-id')[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], next_cursor
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import re
+import time
+
+from . import streams
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_KINDS = ('save', 'load')
+
+# format -> (content type, file extension)
+ARCHIVE_FORMATS = {
+    'tar': ('application/x-tar', '.tar'),
+    'gz': ('application/gzip', '.tar.gz'),
+    'zst': ('application/zstd', '.tar.zst'),
+}
+
+
+def available_formats():
+    return [fmt for fmt in ARCHIVE_FORMATS if fmt != 'zst' or streams.zstandard is not None]
+
+
+def archive_name(images, fmt):
+    base = re.sub(r'[^\w.-]+', '_', images[0]) if len(images) == 1 else 'images'
+    return base + ARCHIVE_FORMATS[fmt][1]
+
+
+async def _finish_save(chunks, progress):
+    await progress.aupdate(state='running')
+    try:
+        async for chunk in progress.atrack(chunks):
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        await progress.aupdate(state='error', error='Download cancelled', finished=time.time())
+        raise
+    except Exception as e:
+        await progress.aupdate(state='error', error=str(e), finished=time.time())
+        raise
+    await progress.aupdate(state='done', finished=time.time())
+
+
+def save_output(images, fmt, progress):
+    """`docker save` of all `images` as one archive, compressed on the fly, for a streaming response."""
+    output = streams.ProcessOutput(['save'] + list(images), f"Saving {', '.join(images)}")
+    if fmt == 'gz':
+        output.pipe(streams.agzip_chunks)
+    elif fmt == 'zst':
+        output.pipe(streams.azstd_chunks)
+    return output.pipe(_finish_save, progress)
+
+
+async def load_stream(chunks, progress):
+    """Pipes an image archive into `docker load` and returns the names of the loaded images.
+
+    docker load detects gzip, bzip2, xz and zstd compression by itself, so the
+    upload is passed through untouched.
+    """
+    await progress.aupdate(state='running')
+    try:
+        returncode, output = await streams.apipe(['load'], progress.atrack(chunks), 'docker load')
+    except IOError as e:
+        await progress.aupdate(state='error', error=str(e), finished=time.time())
+        raise
+    if returncode:
+        await progress.aupdate(state='error', error=output or 'docker load failed', finished=time.time())
+        raise IOError(output or 'docker load failed')
+    loaded = [line.split(':', 1)[1].strip() for line in output.splitlines() if line.startswith('Loaded image')]
+    await progress.aupdate(state='done', file=', '.join(loaded), finished=time.time())
+    return loaded
+
+
+def list_transfers():
+    return streams.list_transfers(TRANSFER_KINDS)
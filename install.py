@@ -0,0 +1,158 @@
+import glob
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+from core.utils import run_command
+
+logger = logging.getLogger(__name__)
+
+STAGE_TIMEOUT = 600
+OUTPUT_LIMIT = 4000
+
+CONFLICTING_PACKAGES = ['docker.io', 'docker-compose', 'docker-compose-v2', 'docker-doc', 'podman-docker', 'containerd', 'runc']
+DEPENDENCIES = ['ca-certificates', 'curl']
+DOCKER_PACKAGES = ['docker-ce', 'docker-ce-cli', 'containerd.io', 'docker-buildx-plugin', 'docker-compose-plugin']
+KEY_FILE = '/etc/apt/keyrings/docker.asc'
+SOURCES_FILE = '/etc/apt/sources.list.d/docker.sources'
+
+
+def installed_packages(packages):
+    """Returns the subset of `packages` dpkg reports as installed; no root needed."""
+    try:
+        result = subprocess.run(
+            ['dpkg-query', '-W', '-f', '${Package} ${Status}\n', *packages],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return set()
+    # dpkg-query exits 1 when some package is unknown but still lists the known ones
+    return {line.split()[0] for line in result.stdout.decode(errors='replace').splitlines() if line.endswith(' installed')}
+
+
+def _all_installed(packages):
+    return lambda: installed_packages(packages) >= set(packages)
+
+
+def _none_installed(packages):
+    return lambda: not installed_packages(packages)
+
+
+def _file_present(path):
+    return lambda: os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+def offline_dir(tool=None):
+    """Directory of .deb files to install from instead of download.docker.com, if configured."""
+    return (tool.config_data.get('offline_deb_dir') if tool else None) or getattr(settings, 'DOCKER_OFFLINE_DEB_DIR', None)
+
+
+def get_stages(deb_dir=None):
+    """Returns (key, name, command, probe) tuples; a stage whose probe returns True is skipped."""
+    remove = ("remove_conflicts", "Uninstalling conflicting packages...",
+              "apt-get remove -y " + ' '.join(CONFLICTING_PACKAGES), _none_installed(CONFLICTING_PACKAGES))
+    if deb_dir:
+        return [
+            remove,
+            ("install_offline", "Installing Docker packages from local .deb files...",
+             f"apt-get install -y --no-download {shlex.quote(deb_dir.rstrip('/'))}/*.deb", _all_installed(DOCKER_PACKAGES)),
+        ]
+    return [
+        remove,
+        # Index refreshes are only needed when the install that follows them still has work to do
+        ("update_apt", "Updating apt repositories...", "apt-get update", _all_installed(DEPENDENCIES)),
+        ("install_dependencies", "Installing dependencies...", "apt-get install -y " + ' '.join(DEPENDENCIES), _all_installed(DEPENDENCIES)),
+        ("gpg_key", "Setting up Docker GPG key...", "bash -c 'install -m 0755 -d /etc/apt/keyrings && curl -fsSL https://download.docker.com/linux/$(. /etc/os-release && echo \"$ID\")/gpg -o /etc/apt/keyrings/docker.asc && chmod a+r /etc/apt/keyrings/docker.asc'", _file_present(KEY_FILE)),
+        ("repository", "Adding Docker repository...", "bash -c 'echo \"Types: deb\nURIs: https://download.docker.com/linux/$(. /etc/os-release && echo \"$ID\")\nSuites: $(. /etc/os-release && echo \"${UBUNTU_CODENAME:-$VERSION_CODENAME}\")\nComponents: stable\nArchitectures: $(dpkg --print-architecture)\nSigned-By: /etc/apt/keyrings/docker.asc\" | tee /etc/apt/sources.list.d/docker.sources > /dev/null && rm -f /etc/apt/sources.list.d/docker.list'", _file_present(SOURCES_FILE)),
+        ("update_index", "Updating package index...", "apt-get update", _all_installed(DOCKER_PACKAGES)),
+        ("install_docker", "Installing Docker packages...", "apt-get install -y " + ' '.join(DOCKER_PACKAGES), _all_installed(DOCKER_PACKAGES)),
+    ]
+
+
+def _tail(text):
+    return text[-OUTPUT_LIMIT:] if text else ''
+
+
+def run_pipeline(tool_pk):
+    """Runs the install stages, skipping satisfied ones and resuming after a failure.
+
+    Per-stage state, timing and output go to config_data['install'] so a retry
+    starts at the stage that failed instead of from scratch.
+    """
+    from core.models import Tool
+    tool = Tool.objects.get(pk=tool_pk)
+    deb_dir = offline_dir(tool)
+    mode = 'offline' if deb_dir else 'online'
+    previous = tool.config_data.get('install') or {}
+    stages = get_stages(deb_dir)
+    keys = [key for key, _, _, _ in stages]
+
+    # Stages before the one that failed last time already ran in the same mode
+    first = 0
+    if previous.get('mode') == mode and previous.get('failed_stage') in keys:
+        first = keys.index(previous['failed_stage'])
+    results = {k: v for k, v in (previous.get('stages') or {}).items() if k in keys[:first]}
+    state = {'mode': mode, 'failed_stage': None, 'started': time.time(), 'stages': results}
+
+    def save(error=None, **fields):
+        tool = Tool.objects.get(pk=tool_pk)
+        for name, value in fields.items():
+            setattr(tool, name, value)
+        tool.config_data['install'] = state
+        if error is not None:
+            tool.config_data['error_log'] = error
+        elif tool.status == 'installed':
+            tool.config_data.pop('error_log', None)
+        tool.save()
+
+    if deb_dir and not glob.glob(os.path.join(deb_dir, '*.deb')):
+        state['failed_stage'] = keys[-1]
+        save(status='error', error=f"No .deb files found in {deb_dir}")
+        return
+
+    for key, stage_name, command, probe in stages[first:]:
+        save(current_stage=stage_name)
+        started = time.monotonic()
+        if probe():
+            results[key] = {'status': 'skipped', 'duration': round(time.monotonic() - started, 3), 'output': ''}
+            continue
+        try:
+            output = run_command(command, shell=True, capture_output=True, timeout=STAGE_TIMEOUT)
+        except Exception as e:
+            logger.error(f"Docker install stage {key} failed: {e}")
+            results[key] = {'status': 'failed', 'duration': round(time.monotonic() - started, 3), 'output': _tail(str(e))}
+            state['failed_stage'] = key
+            save(status='error', error=str(e))
+            return
+        text = output.decode(errors='replace') if isinstance(output, bytes) else str(output or '')
+        results[key] = {'status': 'done', 'duration': round(time.monotonic() - started, 3), 'output': _tail(text)}
+
+    state['finished'] = time.time()
+    save(status='installed', current_stage="Installation completed successfully")
+
+
+def start(tool_pk):
+    def target():
+        # Use a separate database connection for the background thread to avoid locking issues
+        from django import db
+        db.connections.close_all()
+        try:
+            run_pipeline(tool_pk)
+        except Exception as e:
+            logger.error(f"Docker install failed: {e}")
+            try:
+                from core.models import Tool
+                tool = Tool.objects.get(pk=tool_pk)
+                tool.status = 'error'
+                tool.config_data['error_log'] = str(e)
+                tool.save()
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=target, name='docker-install', daemon=True)
+    thread.start()
+    return thread
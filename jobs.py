@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def run_periodically(name, interval, func, *args, **kwargs):
+    """Starts `func` in a background thread unless it already ran within `interval` seconds.
+
+    Used for jobs started from the dashboard, such as a manual update check.
+    The cache entry acts as a lock shared by every worker using the same
+    cache backend.
+    Set DOCKER_BACKGROUND_JOBS = False to disable all of them.
+    """
+    if not getattr(settings, 'DOCKER_BACKGROUND_JOBS', True):
+        return False
+    if not cache.add(f"docker_job:{name}", True, interval):
+        return False
+
+    def run():
+        # Use a separate database connection for the background thread to avoid locking issues
+        from django import db
+        db.connections.close_all()
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Docker background job {name} failed: {e}")
+        finally:
+            db.connections.close_all()
+
+    threading.Thread(target=run, name=f"docker-{name}", daemon=True).start()
+    return True
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def worker_jobs():
+    """Returns (name, func, interval) for each job `start_workers` keeps running."""
+    from . import events, logindex, updates
+    return [
+        ('events', events.consume, events.RESTART_DELAY),
+        ('log-index', logindex.index_all, logindex.INDEX_INTERVAL),
+        ('image-updates', updates.run_update_check, updates.CHECK_INTERVAL),
+    ]
+
+
+def run_forever(name, func, interval):
+    """Calls `func` again `interval` seconds after each run ends; failures are logged and retried."""
+    from django import db
+    while True:
+        db.connections.close_all()
+        try:
+            func()
+        except Exception as e:
+            logger.error(f"Docker worker {name} failed: {e}")
+        time.sleep(interval)
+
+
+def start_workers():
+    """Starts every worker job in a daemon thread of this process, unless it is already running.
+
+    Called by `manage.py docker_worker`, or by the web server on its first
+    request when DOCKER_IN_PROCESS_WORKERS is set.
+    """
+    with _workers_lock:
+        for name, func, interval in worker_jobs():
+            thread = _workers.get(name)
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=run_forever, args=(name, func, interval), name=f"docker-{name}", daemon=True)
+                thread.start()
+                _workers[name] = thread
+        return list(_workers.values())
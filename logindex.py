@@ -0,0 +1,300 @@
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from core.docker_cli_wrapper import DockerCLI
+
+from .cli import docker_argv
+from .storage import data_dir
+
+logger = logging.getLogger(__name__)
+
+INDEX_INTERVAL = 60
+INITIAL_WINDOW = 24 * 3600
+BATCH_LINES = 50000
+RETENTION_HOURS = 7 * 24
+MAX_WORKERS = 8
+MAX_RESULTS = 200
+TOKEN_RE = re.compile(r'[a-z0-9_]{2,64}')
+
+_index_lock = threading.Lock()
+
+# Segments live in <DOCKER_DATA_DIR>/logs/<YYYYMMDDHH>/<container id>.log.gz,
+# one gzip member per indexing pass. Next to them, index.sqlite holds the
+# hour's inverted index as a contentless FTS5 table: it stores only tokens,
+# keyed by a rowid that packs the line's second within the hour, the
+# container's number in the bucket and the line's number in its segment. A
+# query looks up its tokens' posting lists without reading anything else,
+# `ORDER BY rowid DESC` returns the newest lines first, and only segments
+# with lines in the result are decompressed.
+LOG_SUFFIX = '.log.gz'
+INDEX_FILE = 'index.sqlite'
+LINE_BITS = 24
+CONTAINER_BITS = 20
+SECOND_SHIFT = LINE_BITS + CONTAINER_BITS
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS containers (
+    id INTEGER PRIMARY KEY,
+    container_id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    lines INTEGER NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(
+    tokens, content='', detail=none, tokenize="unicode61 tokenchars '_'"
+);
+"""
+
+
+def tokenize(text):
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+def _bucket(ts):
+    """Maps an RFC3339 timestamp (or a prefix of one) to its hourly bucket name."""
+    return ts[0:4] + ts[5:7] + ts[8:10] + ts[11:13]
+
+
+def _to_epoch(ts):
+    return int(datetime.strptime(ts[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).timestamp())
+
+
+def _second(ts, pad='0000-01-01T00:00:00'):
+    """Second within the hour of a timestamp; digits missing from a prefix are taken from `pad`."""
+    ts = ts[:19] + pad[len(ts):]
+    return int(ts[14:16]) * 60 + int(ts[17:19])
+
+
+def _root():
+    return data_dir('logs')
+
+
+def _connect(bucket_dir):
+    db = sqlite3.connect(os.path.join(bucket_dir, INDEX_FILE), timeout=60, isolation_level=None)
+    # WAL lets searches read while a pass appends
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(SCHEMA)
+    return db
+
+
+def _read_state(root):
+    try:
+        with open(os.path.join(root, 'state.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(root, state):
+    path = os.path.join(root, 'state.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def _append_segment(bucket_dir, container_id, name, lines):
+    """Appends lines to the hour's log of a container and adds them to the hour's index."""
+    db = _connect(bucket_dir)
+    try:
+        # Index threads of different containers share the file; take the write lock up front
+        db.execute('BEGIN IMMEDIATE')
+        row = db.execute('SELECT id, lines FROM containers WHERE container_id = ?', (container_id,)).fetchone()
+        if row:
+            number, first = row
+            db.execute('UPDATE containers SET name = ?, lines = ? WHERE id = ?', (name, first + len(lines), number))
+        else:
+            number, first = db.execute(
+                'INSERT INTO containers (container_id, name, lines) VALUES (?, ?, ?)', (container_id, name, len(lines)),
+            ).lastrowid, 0
+        db.executemany('INSERT INTO lines (rowid, tokens) VALUES (?, ?)', (
+            ((_second(line) << SECOND_SHIFT) | (number << LINE_BITS) | n, ' '.join(tokenize(line.partition(' ')[2])))
+            for n, line in enumerate(lines, first)
+        ))
+        # Each pass appends a new gzip member; readers see the members as one stream
+        with gzip.open(os.path.join(bucket_dir, container_id + LOG_SUFFIX), 'ab') as f:
+            f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        db.execute('COMMIT')
+    except BaseException:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        raise
+    finally:
+        db.close()
+
+
+def _read_logs(container_id, since, until):
+    """Yields the container's log lines with timestamps from `since` to `until` (epoch seconds)."""
+    process = subprocess.Popen(
+        docker_argv('logs', '--timestamps', '--since', str(since), '--until', str(until), container_id),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+    )
+    try:
+        for line in process.stdout:
+            yield line.decode('utf-8', errors='replace').rstrip('\n')
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        if process.wait() and process.returncode != -9:
+            logger.warning(f"docker logs {container_id} exited with {process.returncode}")
+
+
+def index_container(root, container, last=None):
+    """Indexes log lines newer than the `last` watermark and returns the new watermark.
+
+    The backlog is read one hour (one bucket) at a time and written every
+    BATCH_LINES lines, so a container that was not indexed for a while is
+    caught up without holding its logs in memory.
+    """
+    now = int(time.time())
+    since = max(_to_epoch(last) if last else now - INITIAL_WINDOW, now - RETENTION_HOURS * 3600)
+    newest = last
+    while since < now:
+        until = min(now, (since // 3600 + 1) * 3600)
+        # `since` has second granularity, so lines up to the watermark come again
+        floor = newest
+        by_bucket = {}
+        pending = 0
+        for line in _read_logs(container.id, since, until):
+            ts = line.partition(' ')[0]
+            if len(ts) < 20 or ts[4] != '-' or ts[10] != 'T':
+                continue
+            if floor and ts <= floor:
+                continue
+            by_bucket.setdefault(_bucket(ts), []).append(line)
+            pending += 1
+            if newest is None or ts > newest:
+                newest = ts
+            if pending >= BATCH_LINES:
+                _write_buckets(root, container, by_bucket)
+                by_bucket, pending = {}, 0
+        _write_buckets(root, container, by_bucket)
+        since = until
+    return newest
+
+
+def _write_buckets(root, container, by_bucket):
+    for bucket, lines in by_bucket.items():
+        bucket_dir = os.path.join(root, bucket)
+        os.makedirs(bucket_dir, exist_ok=True)
+        _append_segment(bucket_dir, container.id, container.name, lines)
+
+
+def apply_retention(root, hours=RETENTION_HOURS):
+    cutoff = time.strftime('%Y%m%d%H', time.gmtime(time.time() - hours * 3600))
+    for entry in os.listdir(root):
+        if entry.isdigit() and len(entry) == 10 and entry < cutoff:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+def index_all():
+    """Runs one incremental indexing pass over every container."""
+    if not _index_lock.acquire(blocking=False):
+        return
+    try:
+        root = _root()
+        state = _read_state(root)
+        containers = DockerCLI().containers.list(all=True)
+
+        def run(container):
+            try:
+                return container, index_container(root, container, state.get(container.id, {}).get('last'))
+            except Exception as e:
+                logger.warning(f"Log indexing failed for {container.name}: {e}")
+                return container, state.get(container.id, {}).get('last')
+
+        new_state = {}
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+            for container, last in pool.map(run, containers):
+                if last:
+                    new_state[container.id] = {'name': container.name, 'last': last}
+        _write_state(root, new_state)
+        apply_retention(root)
+    finally:
+        _index_lock.release()
+
+
+def _search_bucket(bucket_dir, tokens, containers, since, until, limit):
+    if not os.path.exists(os.path.join(bucket_dir, INDEX_FILE)):
+        return []
+    db = sqlite3.connect(os.path.join(bucket_dir, INDEX_FILE), timeout=60, isolation_level=None)
+    try:
+        names = {number: (container_id, name) for number, container_id, name
+                 in db.execute('SELECT id, container_id, name FROM containers')}
+        conditions, params = [], []
+        if tokens:
+            # Quoted, so tokens are never read as FTS5 operators; listed tokens must all match
+            conditions.append('lines MATCH ?')
+            params.append(' '.join(f'"{token}"' for token in sorted(tokens)))
+        if containers:
+            numbers = [number for number, (container_id, name) in names.items()
+                       if name in containers or any(container_id.startswith(c) for c in containers)]
+            if not numbers:
+                return []
+            conditions.append(f"(rowid >> {LINE_BITS}) & {(1 << CONTAINER_BITS) - 1} IN ({', '.join('?' * len(numbers))})")
+            params.extend(numbers)
+        bucket = os.path.basename(bucket_dir)
+        if since and _bucket(since) == bucket:
+            conditions.append('rowid >= ?')
+            params.append(_second(since) << SECOND_SHIFT)
+        if until and _bucket(until) == bucket:
+            conditions.append('rowid < ?')
+            params.append((_second(until, '9999-12-31T23:59:59') + 1) << SECOND_SHIFT)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rowids = [rowid for rowid, in db.execute(f"SELECT rowid FROM lines {where} ORDER BY rowid DESC LIMIT ?", (*params, limit))]
+    finally:
+        db.close()
+
+    postings = {}
+    for rowid in rowids:
+        postings.setdefault((rowid >> LINE_BITS) & ((1 << CONTAINER_BITS) - 1), []).append(rowid & ((1 << LINE_BITS) - 1))
+    results = []
+    # Only segments with lines in the result are decompressed
+    for number, line_numbers in postings.items():
+        container_id, name = names[number]
+        with gzip.open(os.path.join(bucket_dir, container_id + LOG_SUFFIX), 'rt', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        for line_number in line_numbers:
+            if line_number >= len(lines):
+                continue
+            ts, _, message = lines[line_number].partition(' ')
+            if since and ts < since:
+                continue
+            if until and ts[:len(until)] > until:
+                continue
+            results.append({'time': ts, 'container': name or container_id, 'container_id': container_id, 'line': message})
+    return results
+
+
+def search(query='', containers=None, since=None, until=None, limit=MAX_RESULTS):
+    """Searches indexed logs, newest first.
+
+    All query tokens must appear in a line. `containers` filters by container
+    name or id prefix; `since`/`until` are UTC timestamps or prefixes of one
+    (e.g. "2026-10-19T08:00").
+    """
+    root = _root()
+    tokens = tokenize(query)
+    since_bucket = _bucket(since) if since else None
+    until_bucket = _bucket(until).ljust(10, '9') if until else None
+
+    buckets = sorted((b for b in os.listdir(root) if b.isdigit() and len(b) == 10), reverse=True)
+    results = []
+    for bucket in buckets:
+        if (since_bucket and bucket < since_bucket) or (until_bucket and bucket > until_bucket):
+            continue
+        # Buckets are disjoint hours, so each older one only fills what is left of the limit
+        results.extend(_search_bucket(os.path.join(root, bucket), tokens, containers, since, until, limit - len(results)))
+        if len(results) >= limit:
+            break
+
+    results.sort(key=lambda r: r['time'], reverse=True)
+    return results[:limit]
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ...jobs import start_workers
+
+
+class Command(BaseCommand):
+    help = "Runs the Docker event consumer and the module's periodic jobs until interrupted."
+
+    def handle(self, *args, **options):
+        threads = start_workers()
+        self.stdout.write(f"Running {', '.join(thread.name for thread in threads)}")
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docker_module', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DockerEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField()),
+                ('type', models.CharField(max_length=32)),
+                ('action', models.CharField(max_length=64)),
+                ('actor_id', models.CharField(help_text='ID of the container, image, volume or network', max_length=128)),
+                ('actor_name', models.CharField(blank=True, default='', max_length=255)),
+                ('attributes', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'ordering': ['-time', '-id'],
+                'indexes': [models.Index(fields=['time', 'id'], name='docker_event_time_idx'), models.Index(fields=['type', 'time'], name='docker_event_type_idx'), models.Index(fields=['action', 'time'], name='docker_event_action_idx'), models.Index(fields=['actor_id', 'time'], name='docker_event_actor_idx'), models.Index(fields=['actor_name', 'time'], name='docker_event_actor_name_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+def delete_duplicates(apps, schema_editor):
+    # Consumers in workers with separate caches could store the same event more than once
+    DockerEvent = apps.get_model('docker_module', 'DockerEvent')
+    keep = DockerEvent.objects.values('time', 'type', 'actor_id', 'action').annotate(first=models.Min('id')).values('first')
+    DockerEvent.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docker_module', '0002_dockerevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dockerevent',
+            constraint=models.UniqueConstraint(fields=('time', 'type', 'actor_id', 'action'), name='docker_event_unique'),
+        ),
+    ]
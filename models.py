@@ -10,3 +10,29 @@ class DockerRegistry(models.Model):
 
     def __str__(self):
         return self.name
+
+class DockerEvent(models.Model):
+    """An event reported by the daemon through `docker events`."""
+    time = models.DateTimeField()
+    type = models.CharField(max_length=32)
+    action = models.CharField(max_length=64)
+    actor_id = models.CharField(max_length=128, help_text="ID of the container, image, volume or network")
+    actor_name = models.CharField(max_length=255, blank=True, default='')
+    attributes = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ['-time', '-id']
+        indexes = [
+            models.Index(fields=['time', 'id'], name='docker_event_time_idx'),
+            models.Index(fields=['type', 'time'], name='docker_event_type_idx'),
+            models.Index(fields=['action', 'time'], name='docker_event_action_idx'),
+            models.Index(fields=['actor_id', 'time'], name='docker_event_actor_idx'),
+            models.Index(fields=['actor_name', 'time'], name='docker_event_actor_name_idx'),
+        ]
+        constraints = [
+            # Lets every consumer insert with ignore_conflicts instead of coordinating
+            models.UniqueConstraint(fields=['time', 'type', 'actor_id', 'action'], name='docker_event_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.action} {self.actor_name or self.actor_id}"
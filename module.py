@@ -1,5 +1,4 @@
 import subprocess
-import threading
 import os
 import pty
 import time
@@ -9,6 +8,11 @@ from core.plugin_system import BaseModule
 from core.terminal_manager import TerminalSession
 from core.utils import run_command
 from core.docker_cli_wrapper import DockerCLI
+from . import updates
+from .compose import group_by_project
+from . import backups
+from . import imagearchive
+from . import install
 import logging
 import select
 
@@ -123,8 +127,13 @@ class Module(BaseModule):
                 context['used_images'] = used_images
                 context['used_volumes'] = used_volumes
                 context['containers'] = sorted(containers, key=lambda x: x.name)
+                context['compose_projects'], context['standalone_containers'] = group_by_project(context['containers'])
                 context['images'] = sorted(client.images.list(), key=lambda x: x.tags[0] if x.tags else x.id)
+                context['stale_images'] = updates.stale_image_ids(context['images'])
+                context['image_archive_formats'] = imagearchive.available_formats()
+                context['image_updates_checked_at'] = updates.get_update_status()['checked_at']
                 context['volumes'] = sorted(client.volumes.list(), key=lambda x: x.name)
+                context['backup_files'] = backups.list_backups()
                 context['networks'] = sorted(client.networks.list(), key=lambda x: x.name)
                 context['docker_info'] = client.info()
                 
@@ -168,44 +177,7 @@ class Module(BaseModule):
 
         tool.status = 'installing'
         tool.save()
-        
-        def run_install():
-            # Use a separate database connection for the background thread to avoid locking issues
-            from django import db
-            db.connections.close_all()
-            
-            stages = [
-                ("Uninstalling conflicting packages...", "apt-get remove -y docker.io docker-compose docker-compose-v2 docker-doc podman-docker containerd runc"),
-                ("Updating apt repositories...", "apt-get update"),
-                ("Installing dependencies...", "apt-get install -y ca-certificates curl"),
-                ("Setting up Docker GPG key...", "bash -c 'install -m 0755 -d /etc/apt/keyrings && curl -fsSL https://download.docker.com/linux/$(. /etc/os-release && echo \"$ID\")/gpg -o /etc/apt/keyrings/docker.asc && chmod a+r /etc/apt/keyrings/docker.asc'"),
-                ("Adding Docker repository...", "bash -c 'echo \"Types: deb\nURIs: https://download.docker.com/linux/$(. /etc/os-release && echo \"$ID\")\nSuites: $(. /etc/os-release && echo \"${UBUNTU_CODENAME:-$VERSION_CODENAME}\")\nComponents: stable\nArchitectures: $(dpkg --print-architecture)\nSigned-By: /etc/apt/keyrings/docker.asc\" | tee /etc/apt/sources.list.d/docker.sources > /dev/null && rm -f /etc/apt/sources.list.d/docker.list'"),
-                ("Updating package index...", "apt-get update"),
-                ("Installing Docker packages...", "apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin")
-            ]
-            try:
-                for stage_name, command in stages:
-                    # Refresh tool object from DB
-                    from core.models import Tool
-                    tool_refresh = Tool.objects.get(pk=tool.pk)
-                    tool_refresh.current_stage = stage_name
-                    tool_refresh.save()
-                    run_command(command, shell=True, capture_output=False, timeout=600)
-                
-                tool_refresh = Tool.objects.get(pk=tool.pk)
-                tool_refresh.status = 'installed'
-                tool_refresh.current_stage = "Installation completed successfully"
-                tool_refresh.save()
-            except Exception as e:
-                try:
-                    tool_refresh = Tool.objects.get(pk=tool.pk)
-                    tool_refresh.status = 'error'
-                    tool_refresh.config_data['error_log'] = str(e)
-                    tool_refresh.save()
-                except:
-                    pass
-
-        threading.Thread(target=run_install).start()
+        install.start(tool.pk)
 
     def get_terminal_session_types(self):
         return {'docker': DockerSession}
@@ -228,22 +200,40 @@ class Module(BaseModule):
         ]
 
     def get_urls(self):
-        from . import views
+        from . import uploads, views
         return [
             path('docker/container/<str:container_id>/act/<str:action>/', views.container_action, name='docker_container_action'),
+            path('docker/stack/<str:project>/act/<str:action>/', views.docker_stack_action, name='docker_stack_action'),
             path('docker/container/<str:container_id>/logs/', views.container_logs, name='docker_container_logs'),
             path('docker/container/<str:container_id>/logs/download/', views.container_logs_download, name='docker_container_logs_download'),
+            path('docker/logs/search/', views.docker_logs_search, name='docker_logs_search'),
+            path('docker/events/', views.docker_events, name='docker_events'),
             path('docker/service/logs/', views.docker_service_logs, name='docker_service_logs'),
             path('docker/service/logs/download/', views.docker_service_logs_download, name='docker_service_logs_download'),
             path('docker/container/<str:container_id>/config/', views.docker_container_config, name='docker_container_config'),
+            path('docker/container/<str:container_id>/files/', views.docker_container_files, name='docker_container_files'),
+            path('docker/container/<str:container_id>/files/download/', views.docker_container_file_download, name='docker_container_file_download'),
+            path('docker/container/<str:container_id>/files/upload/', views.docker_container_file_upload, name='docker_container_file_upload'),
             path('docker/container/<str:container_id>/shell/', views.docker_container_shell, name='docker_container_shell'),
             path('docker/image/<str:image_id>/<str:action>/', views.docker_image_action, name='docker_image_action'),
             path('docker/registry/create/', views.docker_registry_create, name='docker_registry_create'),
             path('docker/registry/<int:registry_id>/delete/', views.docker_registry_delete, name='docker_registry_delete'),
+            path('docker/registry/<int:registry_id>/browse/', views.docker_registry_browse, name='docker_registry_browse'),
+            path('docker/image/suggest/', views.docker_image_suggest, name='docker_image_suggest'),
+            path('docker/image/check-updates/', views.docker_image_check_updates, name='docker_image_check_updates'),
+            path('docker/image/save/', views.docker_image_save, name='docker_image_save'),
+            path('docker/image/load/', views.docker_image_load, name='docker_image_load'),
+            path('docker/image/transfers/', views.docker_image_transfers, name='docker_image_transfers'),
             path('docker/network/create/', views.docker_network_create, name='docker_network_create'),
             path('docker/network/<str:network_id>/<str:action>/', views.docker_network_action, name='docker_network_action'),
             path('docker/volume/create/', views.docker_volume_create, name='docker_volume_create'),
+            path('docker/volume/backup/', views.docker_volume_backup_many, name='docker_volume_backup_many'),
+            path('docker/volume/backups/', views.docker_volume_backups, name='docker_volume_backups'),
+            path('docker/volume/backups/<str:filename>/<str:action>/', views.docker_volume_backup_file, name='docker_volume_backup_file'),
+            path('docker/volume/<str:volume_name>/backup/', views.docker_volume_backup, name='docker_volume_backup'),
+            path('docker/volume/<str:volume_name>/restore/', views.docker_volume_restore, name='docker_volume_restore'),
             path('docker/volume/<str:volume_name>/<str:action>/', views.docker_volume_action, name='docker_volume_action'),
+            path('docker/stream/upload/<str:ticket>/', uploads.upload_view, name='docker_stream_upload'),
         ]
 
     def get_websocket_urls(self):
@@ -251,3 +241,11 @@ class Module(BaseModule):
         return [
             re_path(r'ws/docker/shell/(?P<container_id>[\w.-]+)/$', consumers.TerminalConsumer.as_asgi(), {'session_type': 'docker'}),
         ]
+
+    def get_http_urls(self):
+        # Raw ASGI routes for routers that mount them ahead of the Django application;
+        # get_urls() serves the same paths when they are not
+        from . import uploads
+        return [
+            re_path(r'^docker/stream/upload/(?P<ticket>[\w-]+)/$', uploads.application),
+        ]
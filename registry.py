@@ -0,0 +1,268 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_ACCEPT = ', '.join([
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+])
+
+DOCKER_HUB_HOSTS = {'docker.io', 'index.docker.io', 'registry-1.docker.io', 'registry.hub.docker.com'}
+DOCKER_HUB_REGISTRY = 'https://registry-1.docker.io'
+
+# Responses are served from cache for CACHE_TTL seconds, then revalidated with
+# If-None-Match until CACHE_STALE_TTL, after which the cache backend evicts them.
+CACHE_TTL = 300
+CACHE_STALE_TTL = 24 * 3600
+CATALOG_PAGE_SIZE = 100
+CATALOG_MAX_PAGES = 50
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+class RegistryError(Exception):
+    pass
+
+
+def normalize_registry_url(url):
+    """Turns a DockerRegistry.url into the base URL of its v2 API."""
+    url = (url or '').strip()
+    if '://' not in url:
+        url = 'https://' + url
+    parsed = urlparse(url)
+    if parsed.netloc in DOCKER_HUB_HOSTS:
+        return DOCKER_HUB_REGISTRY
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def parse_image_reference(reference):
+    """Splits `[host/]repository[:tag]` into (registry URL, repository, tag) like the docker CLI does."""
+    name, tag = reference.split('@', 1)[0], 'latest'
+    if ':' in name.rsplit('/', 1)[-1]:
+        name, tag = name.rsplit(':', 1)
+    first, _, rest = name.partition('/')
+    if rest and ('.' in first or ':' in first or first == 'localhost'):
+        host, repository = first, rest
+    else:
+        host, repository = 'docker.io', name
+    base_url = normalize_registry_url(host)
+    if base_url == DOCKER_HUB_REGISTRY and '/' not in repository:
+        repository = 'library/' + repository
+    return base_url, repository, tag
+
+
+def get_session(base_url):
+    """Returns a keep-alive session shared by every client of the same registry."""
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[base_url] = session
+        return session
+
+
+def _parse_challenge(header):
+    scheme, _, params = header.partition(' ')
+    return scheme.lower(), dict(re.findall(r'(\w+)="([^"]*)"', params))
+
+
+class RegistryClient:
+    """Minimal Docker Registry HTTP API v2 client with token and response caching."""
+
+    def __init__(self, url, username=None, password=None, timeout=10):
+        self.base_url = normalize_registry_url(url)
+        self.username = username or None
+        self.password = password or None
+        self.timeout = timeout
+        self.session = get_session(self.base_url)
+
+    @classmethod
+    def for_registry(cls, registry):
+        return cls(registry.url, username=registry.username, password=registry.password)
+
+    @property
+    def is_docker_hub(self):
+        return self.base_url == DOCKER_HUB_REGISTRY
+
+    @property
+    def host(self):
+        return urlparse(self.base_url).netloc
+
+    def image_name(self, repository, tag=None):
+        """Returns the name to pass to `docker pull` for a repository of this registry."""
+        if self.is_docker_hub:
+            name = repository[len('library/'):] if repository.startswith('library/') else repository
+        else:
+            name = f"{self.host}/{repository}"
+        return f"{name}:{tag}" if tag else name
+
+    @property
+    def _auth(self):
+        if self.username and self.password:
+            return (self.username, self.password)
+        return None
+
+    def _token_key(self, params):
+        return (params.get('realm'), params.get('service'), params.get('scope'), self.username)
+
+    def _fetch_token(self, params):
+        key = self._token_key(params)
+        with _tokens_lock:
+            cached = _tokens.get(key)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+        query = {k: params[k] for k in ('service', 'scope') if params.get(k)}
+        response = self.session.get(params['realm'], params=query, auth=self._auth, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RegistryError(f"Token request failed with HTTP {response.status_code}")
+        data = response.json()
+        token = data.get('token') or data.get('access_token')
+        if not token:
+            raise RegistryError("Token endpoint returned no token")
+        # Refresh slightly before the registry considers the token expired.
+        expires_in = int(data.get('expires_in') or 60)
+        with _tokens_lock:
+            _tokens[key] = (token, time.time() + max(expires_in - 10, 10))
+        return token
+
+    def _request(self, method, path, headers=None, params=None):
+        url = f"{self.base_url}/v2/{path}"
+        headers = dict(headers or {})
+        response = self.session.request(method, url, headers=headers, params=params, auth=self._auth, timeout=self.timeout)
+        if response.status_code == 401 and 'WWW-Authenticate' in response.headers:
+            scheme, challenge = _parse_challenge(response.headers['WWW-Authenticate'])
+            if scheme == 'bearer' and challenge.get('realm'):
+                headers['Authorization'] = f"Bearer {self._fetch_token(challenge)}"
+                response = self.session.request(method, url, headers=headers, params=params, timeout=self.timeout)
+        return response
+
+    def _cache_key(self, path, params, accept):
+        raw = f"{self.base_url}|{self.username}|{path}|{sorted((params or {}).items())}|{accept}"
+        return 'docker_registry:' + hashlib.sha1(raw.encode()).hexdigest()
+
+    def _get_cached(self, path, params=None, accept=None):
+        """GETs a JSON document, serving it from cache and revalidating it by ETag."""
+        key = self._cache_key(path, params, accept)
+        entry = cache.get(key)
+        now = time.time()
+        if entry and entry['expires'] > now:
+            return entry
+
+        headers = {'Accept': accept} if accept else {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        response = self._request('GET', path, headers=headers, params=params)
+
+        if response.status_code == 304 and entry:
+            entry['expires'] = now + CACHE_TTL
+        elif response.status_code == 200:
+            entry = {
+                'etag': response.headers.get('ETag'),
+                'digest': response.headers.get('Docker-Content-Digest'),
+                'content_type': response.headers.get('Content-Type'),
+                'link': response.headers.get('Link'),
+                'data': response.json(),
+                'expires': now + CACHE_TTL,
+            }
+        else:
+            raise RegistryError(f"GET {path} failed with HTTP {response.status_code}")
+        cache.set(key, entry, CACHE_STALE_TTL)
+        return entry
+
+    def catalog(self):
+        """Lists repositories, following the registry's pagination links."""
+        repositories = []
+        params = {'n': CATALOG_PAGE_SIZE}
+        for _ in range(CATALOG_MAX_PAGES):
+            entry = self._get_cached('_catalog', params=params)
+            page = entry['data'].get('repositories') or []
+            repositories.extend(page)
+            if not entry.get('link') or not page:
+                break
+            params = {'n': CATALOG_PAGE_SIZE, 'last': page[-1]}
+        self._remember(repositories=repositories)
+        return repositories
+
+    def tags(self, repository):
+        entry = self._get_cached(f"{repository}/tags/list")
+        tags = sorted(entry['data'].get('tags') or [])
+        self._remember(repository=repository, tags=tags)
+        return tags
+
+    def manifest(self, repository, reference):
+        entry = self._get_cached(f"{repository}/manifests/{reference}", accept=MANIFEST_ACCEPT)
+        return {
+            'digest': entry.get('digest'),
+            'media_type': entry.get('content_type'),
+            'manifest': entry['data'],
+        }
+
+    def head_digest(self, repository, reference):
+        """Resolves a tag to its manifest digest without downloading the manifest."""
+        response = self._request('HEAD', f"{repository}/manifests/{reference}", headers={'Accept': MANIFEST_ACCEPT})
+        if response.status_code != 200:
+            raise RegistryError(f"HEAD {repository}:{reference} failed with HTTP {response.status_code}")
+        return response.headers.get('Docker-Content-Digest')
+
+    @property
+    def _index_key(self):
+        return 'docker_registry_index:' + hashlib.sha1(f"{self.base_url}|{self.username}".encode()).hexdigest()
+
+    def _remember(self, repositories=None, repository=None, tags=None):
+        """Records browsed names so the pull form can autocomplete without network calls."""
+        index = cache.get(self._index_key) or {'repositories': [], 'tags': {}}
+        if repositories is not None:
+            index['repositories'] = repositories
+        if repository is not None:
+            if repository not in index['repositories']:
+                index['repositories'].append(repository)
+            index['tags'][repository] = tags or []
+        cache.set(self._index_key, index, CACHE_STALE_TTL)
+
+    def suggestions(self, query, limit=20):
+        """Returns cached image names of this registry that contain `query`."""
+        index = cache.get(self._index_key)
+        if not index:
+            return []
+        query = query.lower()
+        results = []
+        for repository in index['repositories']:
+            names = [self.image_name(repository)]
+            names += [self.image_name(repository, tag) for tag in index['tags'].get(repository, [])]
+            for name in names:
+                if query in name.lower():
+                    results.append(name)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+
+def suggest_images(registries, query, limit=20):
+    """Autocompletes an image name from the cached catalogs of the given registries."""
+    results = []
+    for registry in registries:
+        try:
+            results += RegistryClient.for_registry(registry).suggestions(query, limit - len(results))
+        except Exception as e:
+            logger.warning(f"Registry suggestions failed for {registry}: {e}")
+        if len(results) >= limit:
+            break
+    return results
@@ -0,0 +1,11 @@
+import os
+
+from django.conf import settings
+
+
+def data_dir(*parts):
+    """Returns (and creates) a directory for module data under DOCKER_DATA_DIR."""
+    root = getattr(settings, 'DOCKER_DATA_DIR', None) or os.path.join(settings.BASE_DIR, 'data', 'docker')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
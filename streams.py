@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import subprocess
+import tarfile
+import time
+import uuid
+import zlib
+from contextlib import aclosing
+
+from django.core.cache import cache
+
+from .cli import docker_argv
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+PROGRESS_EVERY = 8 * 1024 * 1024
+TRANSFER_TTL = 24 * 3600
+TRANSFERS_KEY = 'docker_transfers'
+
+
+class TransferProgress:
+    """Tracks one transfer in the cache so any worker can report on it."""
+
+    def __init__(self, kind, name):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.key = f"docker_transfer:{self.job_id}"
+        self.data = {
+            'id': self.job_id, 'kind': kind, 'name': name, 'state': 'queued',
+            'bytes': 0, 'started': time.time(), 'finished': None, 'sha256': None, 'file': None, 'error': None,
+        }
+        self._reported = 0
+        self.save()
+        transfers = cache.get(TRANSFERS_KEY) or []
+        cache.set(TRANSFERS_KEY, ([self.job_id] + transfers)[:100], TRANSFER_TTL)
+
+    def save(self):
+        cache.set(self.key, self.data, TRANSFER_TTL)
+
+    def update(self, **fields):
+        self.data.update(fields)
+        self.save()
+
+    def advance(self, count):
+        self.data['bytes'] += count
+        if self.data['bytes'] - self._reported >= PROGRESS_EVERY:
+            self._reported = self.data['bytes']
+            self.save()
+
+    def track(self, chunks):
+        for chunk in chunks:
+            self.advance(len(chunk))
+            yield chunk
+
+    async def aupdate(self, **fields):
+        self.data.update(fields)
+        await cache.aset(self.key, self.data, TRANSFER_TTL)
+
+    async def atrack(self, chunks):
+        async for chunk in chunks:
+            self.data['bytes'] += len(chunk)
+            if self.data['bytes'] - self._reported >= PROGRESS_EVERY:
+                self._reported = self.data['bytes']
+                await cache.aset(self.key, self.data, TRANSFER_TTL)
+            yield chunk
+
+
+def list_transfers(kinds=None):
+    transfers = []
+    for transfer_id in cache.get(TRANSFERS_KEY) or []:
+        transfer = cache.get(f"docker_transfer:{transfer_id}")
+        if transfer and (kinds is None or transfer['kind'] in kinds):
+            elapsed = (transfer['finished'] or time.time()) - transfer['started']
+            transfer['rate'] = transfer['bytes'] / elapsed if elapsed > 0 else 0
+            transfers.append(transfer)
+    return transfers
+
+
+def docker_popen(args, stdin=None):
+    """Starts a docker CLI command whose stdout (and optionally stdin) is streamed by the caller."""
+    return subprocess.Popen(
+        docker_argv(*args),
+        stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+def _finish(process, what):
+    if process.poll() is None:
+        # The client went away before the stream ended
+        process.terminate()
+    _, stderr = process.communicate()
+    if process.returncode:
+        logger.error(f"{what} failed ({process.returncode}): {(stderr or b'').decode(errors='replace').strip()}")
+    return process.returncode
+
+
+def iter_process(process, what='docker', chunk_size=CHUNK_SIZE):
+    """Yields the stdout of `process` chunk by chunk and reaps it when done or abandoned."""
+    try:
+        while True:
+            chunk = process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        _finish(process, what)
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def pipe_to_process(process, chunks, what='docker'):
+    """Writes chunks to the stdin of `process` and returns (returncode, combined output)."""
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        # The process exited early; its exit status and output explain why
+        pass
+    except Exception:
+        process.kill()
+        process.communicate()
+        raise
+    stdout, stderr = process.communicate()
+    output = ((stdout or b'') + (stderr or b'')).decode(errors='replace').strip()
+    if process.returncode:
+        logger.error(f"{what} failed ({process.returncode}): {output}")
+    return process.returncode, output
+
+
+# Async counterparts for views served over ASGI, where Django only streams
+# async iterators; a sync iterator is collected into memory before sending.
+
+class ProcessOutput:
+    """The stdout of a docker command as an async iterator for StreamingHttpResponse.
+
+    `start()` waits for the first chunk, so a command that fails straight away
+    (a missing container or path) can still be answered with an error status
+    instead of an empty download. `pipe()` adds processing steps: async
+    generator functions taking the chunks so far.
+    """
+
+    def __init__(self, args, what='docker', chunk_size=CHUNK_SIZE):
+        self.args = args
+        self.what = what
+        self.chunk_size = chunk_size
+        self.steps = []
+        self.process = None
+
+    def pipe(self, step, *args):
+        self.steps.append((step, args))
+        return self
+
+    async def start(self):
+        """Starts the command; returns its error output if it failed before writing anything."""
+        self.process = await asyncio.create_subprocess_exec(
+            *docker_argv(*self.args),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        # Drained alongside stdout so a chatty command cannot stall on a full pipe
+        self.stderr = asyncio.ensure_future(self.process.stderr.read())
+        self.first = await self.process.stdout.read(self.chunk_size)
+        if not self.first and await self.process.wait():
+            return await self._error()
+        return None
+
+    async def _error(self):
+        output = (await self.stderr).decode(errors='replace').strip()
+        logger.error(f"{self.what} failed ({self.process.returncode}): {output}")
+        return output or f"{self.what} failed"
+
+    async def _read(self):
+        chunk = self.first
+        while chunk:
+            yield chunk
+            chunk = await self.process.stdout.read(self.chunk_size)
+        if await self.process.wait():
+            raise IOError(await self._error())
+
+    async def __aiter__(self):
+        chunks = self._read()
+        for step, args in self.steps:
+            chunks = step(chunks, *args)
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            self.close()
+            # wait() also waits for stdout to close, which never happens while
+            # a full, unread buffer keeps the pipe paused
+            await self.process.stdout.read()
+            await self.process.wait()
+            await self.stderr
+
+    def close(self):
+        # Django calls this when the response ends, also when the client went away
+        if self.process and self.process.returncode is None:
+            self.process.kill()
+
+
+async def _acompress(chunks, compressor):
+    # Compression runs in a thread so large chunks do not stall the event loop
+    async for chunk in chunks:
+        data = await asyncio.to_thread(compressor.compress, chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def agzip_chunks(chunks, level=6):
+    return _acompress(chunks, zlib.compressobj(level, zlib.DEFLATED, 31))
+
+
+def azstd_chunks(chunks, level=3):
+    """Like agzip_chunks, but needs the optional zstandard package."""
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package")
+    return _acompress(chunks, zstandard.ZstdCompressor(level=level, threads=-1).compressobj())
+
+
+class _BlockReader:
+    def __init__(self, chunks):
+        self.chunks = aiter(chunks)
+        self.buffer = b''
+
+    async def read(self, size):
+        parts = [part async for part in self.stream(size)]
+        return b''.join(parts)
+
+    async def stream(self, size):
+        while size > 0:
+            if not self.buffer:
+                self.buffer = await anext(self.chunks, b'')
+                if not self.buffer:
+                    return
+            part, self.buffer = self.buffer[:size], self.buffer[size:]
+            size -= len(part)
+            yield part
+
+
+def _pax_size(data):
+    for record in data.split(b'\n'):
+        key, _, value = record.partition(b' ')[2].partition(b'=')
+        if key == b'size':
+            return int(value)
+    return None
+
+
+async def afirst_file(chunks):
+    """Yields the content of the first file of a tar stream, without buffering it."""
+    reader = _BlockReader(chunks)
+    size = None
+    while True:
+        header = await reader.read(tarfile.BLOCKSIZE)
+        if len(header) < tarfile.BLOCKSIZE or not header.strip(b'\0'):
+            return
+        try:
+            info = tarfile.TarInfo.frombuf(header, 'utf-8', 'surrogateescape')
+        except tarfile.HeaderError as e:
+            raise IOError(f"Invalid tar stream: {e}")
+        if info.type in (tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.SOLARIS_XHDTYPE, tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK):
+            # Extended headers describe the member that follows them
+            data = await reader.read(info.size + -info.size % tarfile.BLOCKSIZE)
+            if info.type == tarfile.XHDTYPE:
+                size = _pax_size(data[:info.size]) or size
+            continue
+        if not info.isreg():
+            return
+        async for part in reader.stream(info.size if size is None else size):
+            yield part
+        return
+
+
+async def atar_single_file(name, size, chunks, mode=0o644):
+    """Wraps a stream of known size into a one-file tar stream."""
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = mode
+    yield info.tobuf(format=tarfile.PAX_FORMAT)
+    written = 0
+    async for chunk in chunks:
+        written += len(chunk)
+        yield chunk
+    if written != size:
+        raise IOError(f"Expected {size} bytes, received {written}")
+    padding = -size % tarfile.BLOCKSIZE
+    yield b'\0' * padding + b'\0' * (tarfile.BLOCKSIZE * 2)
+
+
+async def apipe(args, chunks, what='docker'):
+    """Feeds an async stream into a docker command's stdin and returns (returncode, combined output)."""
+    process = await asyncio.create_subprocess_exec(
+        *docker_argv(*args),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    output = asyncio.ensure_future(process.stdout.read())
+    try:
+        async for chunk in chunks:
+            process.stdin.write(chunk)
+            # Waiting for the pipe to drain keeps memory flat and slows the sender down
+            await process.stdin.drain()
+        process.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # The process exited early; its exit status and output explain why
+        pass
+    except BaseException:
+        process.kill()
+        await process.wait()
+        await output
+        raise
+    returncode = await process.wait()
+    text = (await output).decode(errors='replace').strip()
+    if returncode:
+        logger.error(f"{what} failed ({returncode}): {text}")
+    return returncode, text
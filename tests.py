@@ -1,13 +1,221 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from core.models import Tool
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+from asgiref.sync import sync_to_async
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import math
 import subprocess
+import threading
+import time
 
 User = get_user_model()
 
+class FakeRegistryHandler(BaseHTTPRequestHandler):
+    """Serves the subset of the registry:2 API used by the module."""
+    repositories = {}
+    requests_seen = []
+    token = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _handle(self):
+        path, _, query = self.path.partition('?')
+        type(self).requests_seen.append((self.command, path))
+        if path == '/token':
+            return self._send(200, {'token': 'secret-token', 'expires_in': 300})
+        if self.token and self.headers.get('Authorization') != f"Bearer {self.token}":
+            realm = f"http://{self.headers['Host']}/token"
+            return self._send(401, {}, {'WWW-Authenticate': f'Bearer realm="{realm}",service="fake"'})
+        if path == '/v2/_catalog':
+            return self._send(200, {'repositories': sorted(self.repositories)})
+        repo, _, rest = path[len('/v2/'):].rpartition('/')
+        if rest == 'list' and repo.endswith('/tags'):
+            repo = repo[:-len('/tags')]
+            body = {'name': repo, 'tags': sorted(self.repositories.get(repo, {}))}
+            etag = '"' + hashlib.sha1(json.dumps(body).encode()).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                return self._send(304)
+            return self._send(200, body, {'ETag': etag})
+        if repo.endswith('/manifests'):
+            repo = repo[:-len('/manifests')]
+            digest = self.repositories.get(repo, {}).get(rest)
+            if not digest:
+                return self._send(404, {'errors': [{'code': 'MANIFEST_UNKNOWN'}]})
+            return self._send(200, {'schemaVersion': 2, 'layers': [{}]}, {'Docker-Content-Digest': digest, 'ETag': f'"{digest}"'})
+        return self._send(404, {})
+
+    do_GET = _handle
+    do_HEAD = _handle
+
+class FakeProcess:
+    """Stands in for a streaming docker CLI process."""
+    def __init__(self, stdout=b'', returncode=0, stderr=b''):
+        import io
+        self.stdout = io.BytesIO(stdout)
+        self.stdin = io.BytesIO()
+        self.stdin.close = lambda: None
+        self.returncode = returncode
+        self.stderr_data = stderr
+
+    def poll(self):
+        return self.returncode
+
+    def communicate(self):
+        return b'', self.stderr_data
+
+    def terminate(self):
+        pass
+
+    kill = terminate
+
+class FakeRegistryMixin:
+    """Starts a local registry:2 stand-in for the duration of a test."""
+    def start_registry(self, repositories, token=None):
+        handler = type('Handler', (FakeRegistryHandler,), {'repositories': repositories, 'requests_seen': [], 'token': token})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}", handler
+
+# Stands in for the docker CLI in streaming tests: records its arguments and
+# stdin next to the spec file, writes the configured output and exit status.
+# With a gate, it pauses after the first stdout part until the gate file exists
+# and fails if that does not happen within 10 seconds.
+FAKE_DOCKER = """
+import json, os, sys, time
+spec_path = sys.argv[1]
+with open(spec_path) as f:
+    spec = json.load(f)
+with open(spec_path + '.argv', 'w') as f:
+    json.dump(sys.argv[2:], f)
+with open(spec_path + '.stdin', 'wb') as f:
+    for chunk in iter(lambda: sys.stdin.buffer.read1(65536), b''):
+        f.write(chunk)
+        f.flush()
+for i, part in enumerate(spec['stdout']):
+    if i == 1 and spec['gate']:
+        deadline = time.time() + 10
+        while not os.path.exists(spec['gate']):
+            if time.time() > deadline:
+                sys.exit(3)
+            time.sleep(0.01)
+    with open(part, 'rb') as f:
+        sys.stdout.buffer.write(f.read())
+    sys.stdout.buffer.flush()
+sys.stderr.write(spec['stderr'])
+sys.exit(spec['returncode'])
+"""
+
+class FakeDocker:
+    def __init__(self, spec_path):
+        self.spec_path = spec_path
+        self.gate = spec_path + '.gate'
+
+    @property
+    def argv(self):
+        with open(self.spec_path + '.argv') as f:
+            return json.load(f)
+
+    @property
+    def stdin(self):
+        try:
+            with open(self.spec_path + '.stdin', 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def open_gate(self):
+        open(self.gate, 'w').close()
+
+class DockerTestMixin:
+    """Logs the test clients in, points DOCKER_DATA_DIR at a throwaway directory and fakes the docker CLI."""
+    def login(self):
+        self.user = User.objects.create_superuser(username='admin', password='password', email='admin@test.com')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        return self.user
+
+    def make_temp_dir(self):
+        import tempfile, shutil
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+    def use_settings(self, **settings):
+        override = override_settings(**settings)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def use_data_dir(self):
+        self.data_dir = self.make_temp_dir()
+        self.use_settings(DOCKER_DATA_DIR=self.data_dir)
+        return self.data_dir
+
+    def fake_docker(self, *stdout, stderr='', returncode=0, gated=False):
+        """Runs a fake docker CLI for this test; each `stdout` part is written separately."""
+        import os, sys
+        directory = self.make_temp_dir()
+        script = os.path.join(directory, 'docker.py')
+        with open(script, 'w') as f:
+            f.write(FAKE_DOCKER)
+        parts = []
+        for i, data in enumerate(stdout):
+            parts.append(os.path.join(directory, f"stdout{i}"))
+            with open(parts[-1], 'wb') as f:
+                f.write(data)
+        docker = FakeDocker(os.path.join(directory, 'spec.json'))
+        with open(docker.spec_path, 'w') as f:
+            json.dump({'stdout': parts, 'stderr': stderr, 'returncode': returncode, 'gate': docker.gate if gated else None}, f)
+        self.use_settings(DOCKER_CLI=[sys.executable, script, docker.spec_path])
+        return docker
+
+    def upload(self, upload_url, chunks, content_type, wait_for=None):
+        """Sends `chunks` to the raw ASGI upload endpoint; each chunk after the first waits for `wait_for()`."""
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from modules.docker import uploads
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': upload_url,
+            'headers': [(b'content-type', content_type.encode()), (b'content-length', str(sum(map(len, chunks))).encode())],
+        }
+        pending = list(chunks)
+        sent = []
+
+        async def receive():
+            if sent and wait_for:
+                for _ in range(500):
+                    if wait_for(sent):
+                        break
+                    await asyncio.sleep(0.01)
+            sent.append(pending.pop(0))
+            return {'type': 'http.request', 'body': sent[-1], 'more_body': bool(pending)}
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+        async_to_sync(uploads.application)(scope, receive, send)
+        return messages[0]['status'], json.loads(messages[1]['body'])
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False, DOCKER_CLI=['docker'])
 class DockerModuleTest(TestCase):
     def setUp(self):
         cache.clear()
@@ -54,7 +262,7 @@ class DockerModuleTest(TestCase):
                 return b""
             if 'inspect' in cmd:
                 if 'img123' in cmd:
-                    return b'[{"Id": "img123", "RepoTags": ["nginx:latest"]}]'
+                    return b'[{"Id": "img123", "RepoTags": ["nginx:latest", "nginx:1.27"]}]'
                 return b'[]'
             if 'volume' in cmd: return b""
             if 'network' in cmd: return b""
@@ -66,31 +274,24 @@ class DockerModuleTest(TestCase):
         response = self.client.get(reverse('tool_detail', kwargs={'tool_name': 'docker'}) + "?tab=images", HTTP_HX_REQUEST='true')
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "nginx:latest")
+        # Exporting an image keeps all of its tags
+        self.assertContains(response, 'name="images" value="nginx:latest nginx:1.27"')
 
-    @patch('modules.docker.views.DockerCLI')
-    def test_container_action(self, mock_docker):
-        mock_client = MagicMock()
-        mock_container = MagicMock()
-        mock_client.containers.get.return_value = mock_container
-        mock_docker.return_value = mock_client
-        
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_container_action(self, mock_run):
         url = reverse('docker_container_action', kwargs={'container_id': 'abc123', 'action': 'start'})
         response = self.client.get(url)
         self.assertEqual(response.status_code, 302)
-        mock_container.start.assert_called_once()
+        mock_run.assert_awaited_once_with(['docker', 'start', 'abc123'])
 
-    @patch('modules.docker.views.DockerCLI')
-    def test_container_logs(self, mock_docker):
-        mock_client = MagicMock()
-        mock_container = MagicMock()
-        mock_container.logs.return_value = b"test logs"
-        mock_client.containers.get.return_value = mock_container
-        mock_docker.return_value = mock_client
-        
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_container_logs(self, mock_run):
+        mock_run.return_value = b"test logs"
         url = reverse('docker_container_logs', kwargs={'container_id': 'abc123'})
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content.decode(), "test logs")
+        mock_run.assert_awaited_once_with(['docker', 'logs', '--tail', '200', 'abc123'], merge_stderr=True)
 
     def test_docker_registry_create(self):
         url = reverse('docker_registry_create')
@@ -148,14 +349,9 @@ class DockerModuleTest(TestCase):
         
         self.assertEqual(module.get_extra_content_template_name(), "core/modules/docker_scripts.html")
 
-    @patch('modules.docker.views.DockerCLI')
-    def test_container_logs_download(self, mock_docker):
-        mock_client = MagicMock()
-        mock_container = MagicMock()
-        mock_container.logs.return_value = b"full logs"
-        mock_client.containers.get.return_value = mock_container
-        mock_docker.return_value = mock_client
-        
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_container_logs_download(self, mock_run):
+        mock_run.return_value = b"full logs"
         url = reverse('docker_container_logs_download', kwargs={'container_id': 'abc123'})
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
@@ -163,10 +359,11 @@ class DockerModuleTest(TestCase):
         self.assertIn(b"full logs", response.content)
 
     @patch('modules.docker.views.run_command')
-    @patch('modules.docker.views.subprocess.check_output')
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
     def test_docker_service_logs_fallback(self, mock_sub, mock_run):
+        from modules.docker.aio import CommandError
         # First call fails
-        mock_sub.side_effect = subprocess.CalledProcessError(1, 'journalctl')
+        mock_sub.side_effect = CommandError(['journalctl'], 1, 'Failed to get journal access')
         # Fallback succeeds
         mock_run.return_value = b"fallback logs"
         url = reverse('docker_service_logs')
@@ -194,7 +391,7 @@ class DockerModuleTest(TestCase):
         self.assertEqual(response.status_code, 302)
         mock_client.volumes.create.assert_called_with(name='test-vol', driver='local')
 
-    @patch('modules.docker.views.subprocess.check_output')
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
     def test_docker_service_logs_download(self, mock_sub):
         mock_sub.return_value = b"full system logs"
         url = reverse('docker_service_logs_download')
@@ -203,10 +400,12 @@ class DockerModuleTest(TestCase):
         self.assertEqual(response['Content-Type'], 'text/plain')
         self.assertIn(b"full system logs", response.content)
 
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
     @patch('modules.docker.views.DockerCLI')
-    def test_docker_container_config_post_recreate(self, mock_docker):
+    def test_docker_container_config_post_recreate(self, mock_docker, mock_run):
         mock_client = MagicMock()
         mock_container = MagicMock()
+        mock_container.id = "abc123"
         mock_container.image.id = "img123"
         mock_container.name = "test-cont"
         mock_client.containers.get.return_value = mock_container
@@ -221,14 +420,62 @@ class DockerModuleTest(TestCase):
             'network': 'bridge'
         })
         self.assertEqual(response.status_code, 302)
-        mock_container.stop.assert_called_once()
-        mock_container.remove.assert_called_once()
+        self.assertEqual([c.args[0] for c in mock_run.await_args_list], [['docker', 'stop', 'abc123'], ['docker', 'rm', '--force', 'abc123']])
         mock_client.containers.run.assert_called()
         
         # Check volume parsing
         args, kwargs = mock_client.containers.run.call_args
         self.assertEqual(kwargs['volumes']['/src']['bind'], '/dst')
 
+    @patch('modules.docker.views.DockerCLI')
+    async def test_recreate_survives_client_disconnect(self, mock_docker):
+        import asyncio
+        from modules.docker import aio
+        await self.async_client.aforce_login(self.user)
+        stopping, release = asyncio.Event(), asyncio.Event()
+
+        async def container_action(container_id, action):
+            if action == 'stop':
+                stopping.set()
+                await release.wait()
+        mock_client = mock_docker.return_value
+        mock_client.containers.get.return_value = MagicMock(id='abc123')
+        url = reverse('docker_container_config', kwargs={'container_id': 'abc123'})
+        with patch.object(aio, 'container_action', side_effect=container_action) as mock_action:
+            request = asyncio.ensure_future(self.async_client.post(url, {'env_vars': ['K=V']}))
+            await stopping.wait()
+            # What the ASGI handler does when the client disconnects
+            request.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await request
+            release.set()
+            await asyncio.gather(*list(aio._detached))
+        self.assertEqual([c.args[1] for c in mock_action.await_args_list], ['stop', 'remove'])
+        mock_client.containers.run.assert_called_once()
+
+    async def test_pull_survives_client_disconnect(self):
+        import asyncio
+        from modules.docker import aio
+        await self.async_client.aforce_login(self.user)
+        pulling, release = asyncio.Event(), asyncio.Event()
+        finished = []
+
+        async def run(args, **kwargs):
+            pulling.set()
+            await release.wait()
+            finished.append(args)
+            return b''
+        url = reverse('docker_image_action', kwargs={'image_id': 'none', 'action': 'pull'})
+        with patch.object(aio, 'run', side_effect=run):
+            request = asyncio.ensure_future(self.async_client.post(url, {'image_name': 'nginx'}))
+            await pulling.wait()
+            request.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await request
+            release.set()
+            await asyncio.gather(*list(aio._detached))
+        self.assertEqual(finished, [['docker', 'pull', 'nginx:latest']])
+
     @patch('modules.docker.module.DockerCLI')
     @patch('modules.docker.module.run_command')
     def test_docker_context_data_with_registries(self, mock_run, mock_docker):
@@ -260,14 +507,37 @@ class DockerModuleTest(TestCase):
         self.assertIn('docker_error', context)
         self.assertEqual(context['docker_error'], "docker api error")
 
-    @patch('modules.docker.views.DockerCLI')
-    def test_docker_image_action_remove(self, mock_docker):
-        mock_client = MagicMock()
-        mock_docker.return_value = mock_client
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_docker_image_action_remove(self, mock_run):
         url = reverse('docker_image_action', kwargs={'image_id': 'img123', 'action': 'remove'})
         response = self.client.get(url)
         self.assertEqual(response.status_code, 302)
-        mock_client.images.remove.assert_called_with('img123', force=True)
+        mock_run.assert_awaited_with(['docker', 'rmi', '--force', 'img123'])
+
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_docker_image_pull_with_registry_credentials(self, mock_run):
+        import base64, os
+        from modules.docker.models import DockerRegistry
+        registry = DockerRegistry.objects.create(name='Private', url='https://registry.example.com', username='bob', password='secret')
+        seen = {}
+
+        async def check_config(args, **kwargs):
+            config_dir = args[args.index('--config') + 1]
+            seen['timeout'] = kwargs['timeout']
+            with open(os.path.join(config_dir, 'config.json')) as f:
+                seen['config'] = json.load(f)
+            seen['dir'] = config_dir
+            return b''
+        mock_run.side_effect = check_config
+
+        url = reverse('docker_image_action', kwargs={'image_id': 'none', 'action': 'pull'})
+        response = self.client.post(url, {'image_name': 'registry.example.com:5000/team/app', 'registry_id': registry.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(mock_run.await_args[0][0], ['docker', '--config', seen['dir'], 'pull', 'registry.example.com:5000/team/app:latest'])
+        self.assertIsNone(seen['timeout'])
+        auth = seen['config']['auths']['registry.example.com:5000']['auth']
+        self.assertEqual(base64.b64decode(auth), b'bob:secret')
+        self.assertFalse(os.path.exists(seen['dir']))
 
     @patch('modules.docker.views.DockerCLI')
     def test_docker_network_action_remove(self, mock_docker):
@@ -321,3 +591,889 @@ class DockerModuleTest(TestCase):
         response = self.client.post(url, {'action': 'disconnect_network', 'network_id': 'net1'})
         self.assertEqual(response.status_code, 302)
         mock_network.disconnect.assert_called_with(mock_container)
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False)
+class DockerRegistryBrowserTest(FakeRegistryMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_superuser(username='admin', password='password', email='admin@test.com')
+        self.client.login(username='admin', password='password')
+
+    def test_catalog_and_tags_with_token_auth(self):
+        from modules.docker.registry import RegistryClient
+        url, handler = self.start_registry({'team/app': {'1.0': 'sha256:aa', '2.0': 'sha256:bb'}}, token='secret-token')
+        client = RegistryClient(url, username='user', password='pass')
+        self.assertEqual(client.catalog(), ['team/app'])
+        self.assertEqual(client.tags('team/app'), ['1.0', '2.0'])
+        self.assertEqual(client.manifest('team/app', '2.0')['digest'], 'sha256:bb')
+        # The token is fetched once and reused for every later request
+        self.assertEqual(sum(1 for _, path in handler.requests_seen if path == '/token'), 1)
+
+    def test_tags_are_cached_and_revalidated_by_etag(self):
+        from modules.docker import registry
+        url, handler = self.start_registry({'app': {'latest': 'sha256:aa'}})
+        client = registry.RegistryClient(url)
+        client.tags('app')
+        client.tags('app')
+        self.assertEqual(handler.requests_seen.count(('GET', '/v2/app/tags/list')), 1)
+
+        # Once the TTL has passed the entry is revalidated and the 304 keeps it alive
+        with patch('modules.docker.registry.time') as mock_time:
+            mock_time.time.return_value = time.time() + registry.CACHE_TTL + 1
+            self.assertEqual(client.tags('app'), ['latest'])
+            self.assertEqual(client.tags('app'), ['latest'])
+        self.assertEqual(handler.requests_seen.count(('GET', '/v2/app/tags/list')), 2)
+
+    def test_registry_browse_and_suggest_views(self):
+        from modules.docker.models import DockerRegistry
+        url, handler = self.start_registry({'team/app': {'1.0': 'sha256:aa'}})
+        reg = DockerRegistry.objects.create(name='Local', url=url)
+
+        response = self.client.get(reverse('docker_registry_browse', kwargs={'registry_id': reg.id}))
+        self.assertContains(response, 'team/app')
+        response = self.client.get(reverse('docker_registry_browse', kwargs={'registry_id': reg.id}) + '?repository=team/app')
+        self.assertContains(response, '1.0')
+
+        # Tag names come from the registry, so they are passed to the script as data, not as code
+        handler.repositories['team/app']["x');alert(1);//"] = 'sha256:bb'
+        cache.clear()
+        response = self.client.get(reverse('docker_registry_browse', kwargs={'registry_id': reg.id}) + '?repository=team/app')
+        # The browser unescapes &#x27; inside an onclick attribute before running it
+        self.assertNotContains(response, "pullFromRegistry('")
+        self.assertContains(response, 'data-image="' + url.split('://', 1)[1] + '/team/app:x&#x27;);alert(1);//"')
+
+        requests_before = len(handler.requests_seen)
+        response = self.client.get(reverse('docker_image_suggest') + '?image_name=team')
+        host = url.split('://', 1)[1]
+        self.assertContains(response, f'{host}/team/app:1.0')
+        self.assertEqual(len(handler.requests_seen), requests_before)
+
+    def test_image_update_detection(self):
+        from modules.docker import updates
+        from modules.docker.models import DockerRegistry
+        url, handler = self.start_registry({'team/app': {'1.0': 'sha256:new', '2.0': 'sha256:same'}})
+        host = url.split('://', 1)[1]
+        reg = DockerRegistry.objects.create(name='Local', url=url)
+
+        stale = MagicMock(id='img1', tags=[f'{host}/team/app:1.0'], attrs={'RepoDigests': [f'{host}/team/app@sha256:old']})
+        fresh = MagicMock(id='img2', tags=[f'{host}/team/app:2.0'], attrs={'RepoDigests': [f'{host}/team/app@sha256:same']})
+        built = MagicMock(id='img3', tags=['local/app:dev'], attrs={'RepoDigests': []})
+
+        results = updates.check_image_updates([stale, fresh, built], [reg])
+        self.assertTrue(results[f'{host}/team/app:1.0']['update_available'])
+        self.assertFalse(results[f'{host}/team/app:2.0']['update_available'])
+        self.assertNotIn('local/app:dev', results)
+        self.assertEqual(updates.stale_image_ids([stale, fresh, built]), {'img1'})
+
+        # Remote digests are cached, so a second run only revalidates the oldest slice of them
+        heads = sum(1 for method, _ in handler.requests_seen if method == 'HEAD')
+        updates.check_image_updates([stale, fresh], [reg])
+        self.assertEqual(sum(1 for method, _ in handler.requests_seen if method == 'HEAD'), heads + 1)
+
+        # ...but a manual check goes to the registry and sees a tag pushed since
+        handler.repositories['team/app']['2.0'] = 'sha256:pushed'
+        results = updates.check_image_updates([stale, fresh], [reg], refresh=True)
+        self.assertEqual(sum(1 for method, _ in handler.requests_seen if method == 'HEAD'), heads + 3)
+        self.assertTrue(results[f'{host}/team/app:2.0']['update_available'])
+
+    def test_scheduled_checks_revalidate_every_digest_before_it_expires(self):
+        from modules.docker import updates
+        client = MagicMock(base_url='https://registry.example', host='registry.example')
+        client.head_digest.side_effect = lambda repository, tag: f'sha256:{tag}'
+        refs = [('team/app', str(i)) for i in range(12)]
+        updates.resolve_digests(client, refs)
+        self.assertEqual(client.head_digest.call_count, 12)
+
+        client.head_digest.reset_mock()
+        clock = time.time()
+        for run in range(updates.REFRESH_RUNS):
+            clock += updates.CHECK_INTERVAL
+            with patch('modules.docker.updates.time.time', return_value=clock):
+                digests = updates.resolve_digests(client, refs)
+            self.assertEqual(len(digests), 12)
+            self.assertLessEqual(client.head_digest.call_count, (run + 1) * math.ceil(12 / updates.REFRESH_RUNS))
+        self.assertEqual({c.args for c in client.head_digest.call_args_list}, set(refs))
+        self.assertGreater(updates.DIGEST_TTL, updates.REFRESH_RUNS * updates.CHECK_INTERVAL)
+
+    @patch('modules.docker.views.run_periodically')
+    def test_manual_check_bypasses_digest_cache(self, mock_run):
+        from modules.docker import updates
+        self.client.post(reverse('docker_image_check_updates'))
+        mock_run.assert_called_with('image-updates', updates.CHECK_INTERVAL, updates.run_update_check, refresh=True)
+
+    def test_parse_image_reference(self):
+        from modules.docker.registry import parse_image_reference, DOCKER_HUB_REGISTRY
+        self.assertEqual(parse_image_reference('nginx'), (DOCKER_HUB_REGISTRY, 'library/nginx', 'latest'))
+        self.assertEqual(parse_image_reference('grafana/grafana:11.0'), (DOCKER_HUB_REGISTRY, 'grafana/grafana', '11.0'))
+        self.assertEqual(parse_image_reference('localhost:5000/app:1'), ('https://localhost:5000', 'app', '1'))
+
+@override_settings(DOCKER_CLI=['docker'])
+class DockerComposeTest(DockerTestMixin, TestCase):
+    def make_container(self, name, project=None, service=None, depends_on=None, status='running'):
+        labels = {}
+        if project:
+            labels['com.docker.compose.project'] = project
+            labels['com.docker.compose.service'] = service or name
+        if depends_on:
+            labels['com.docker.compose.depends_on'] = depends_on
+        container = MagicMock(status=status, attrs={'Config': {'Labels': labels}})
+        container.name = name
+        return container
+
+    def test_group_by_project(self):
+        from modules.docker.compose import group_by_project
+        web = self.make_container('shop-web-1', 'shop', 'web')
+        db = self.make_container('shop-db-1', 'shop', 'db', status='exited')
+        lone = self.make_container('lone')
+        projects, standalone = group_by_project([web, lone, db])
+        self.assertEqual([p['name'] for p in projects], ['shop'])
+        self.assertEqual(projects[0]['containers'], [db, web])
+        self.assertEqual(projects[0]['running'], 1)
+        self.assertEqual(standalone, [lone])
+
+    def test_dependency_levels(self):
+        from modules.docker.compose import dependency_levels
+        db = self.make_container('db', 'shop')
+        cache_ = self.make_container('cache', 'shop')
+        api = self.make_container('api', 'shop', depends_on='db:service_healthy:false,cache:service_started:false')
+        web = self.make_container('web', 'shop', depends_on='api:service_started:false,external:service_started:false')
+        levels = dependency_levels([web, api, db, cache_])
+        self.assertEqual(levels, [[cache_, db], [api], [web]])
+
+    @patch('modules.docker.aio.container_action', new_callable=AsyncMock)
+    def test_stack_restart_runs_services_concurrently(self, mock_action):
+        import asyncio
+        from modules.docker.aio import stack_action
+        containers = [self.make_container(f'svc{i}', 'shop') for i in range(8)]
+
+        async def restart(container_id, action):
+            await asyncio.sleep(0.2)
+        mock_action.side_effect = restart
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(stack_action(containers, 'restart')), {})
+        self.assertLess(time.monotonic() - started, 0.2 * 4)
+        self.assertEqual(mock_action.await_count, 8)
+
+    @patch('modules.docker.aio.container_action', new_callable=AsyncMock)
+    def test_stack_stop_reverses_dependency_order(self, mock_action):
+        import asyncio
+        from modules.docker.aio import stack_action
+        db = self.make_container('db', 'shop')
+        api = self.make_container('api', 'shop', depends_on='db:service_started:false')
+        db.id, api.id = 'db-id', 'api-id'
+        asyncio.run(stack_action([db, api], 'stop'))
+        self.assertEqual([c.args for c in mock_action.await_args_list], [('api-id', 'stop'), ('db-id', 'stop')])
+
+        async def start(container_id, action):
+            if container_id == 'api-id':
+                raise Exception('port already allocated')
+        mock_action.side_effect = start
+        self.assertEqual(asyncio.run(stack_action([db, api], 'start')), {'api': 'port already allocated'})
+
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_stack_action_view(self, mock_run):
+        self.login()
+        inspected = [
+            {'Id': 'web-id', 'Name': '/shop-web-1', 'Config': {'Labels': {'com.docker.compose.project': 'shop', 'com.docker.compose.service': 'web'}}},
+        ]
+        mock_run.side_effect = [b'web-id\n', json.dumps(inspected).encode(), b'']
+        url = reverse('docker_stack_action', kwargs={'project': 'shop', 'action': 'restart'})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('label=com.docker.compose.project=shop', mock_run.await_args_list[0][0][0])
+        mock_run.assert_awaited_with(['docker', 'restart', 'web-id'])
+
+class DockerAsyncClientTest(TestCase):
+    def test_slow_commands_do_not_block_each_other(self):
+        import asyncio
+        from modules.docker import aio
+
+        async def main():
+            return await asyncio.gather(*(aio.run(['sh', '-c', 'sleep 0.3; echo done']) for _ in range(5)))
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(main()), [b'done\n'] * 5)
+        self.assertLess(time.monotonic() - started, 0.3 * 3)
+
+    def test_failure_and_timeout(self):
+        import asyncio
+        from modules.docker import aio
+        with self.assertRaises(aio.CommandError) as raised:
+            asyncio.run(aio.run(['sh', '-c', 'echo No such container >&2; exit 1']))
+        self.assertEqual(raised.exception.output, 'No such container')
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(aio.run(['sleep', '5'], timeout=0.1))
+
+    def test_docker_cli_uses_sudo_unless_root_or_configured(self):
+        from modules.docker.cli import docker_argv
+        with patch('os.geteuid', return_value=1000):
+            self.assertEqual(docker_argv('ps'), ['sudo', '-n', 'docker', 'ps'])
+        with patch('os.geteuid', return_value=0):
+            self.assertEqual(docker_argv('ps'), ['docker', 'ps'])
+        with override_settings(DOCKER_CLI=['/usr/bin/docker', '--host', 'unix:///run/docker.sock']):
+            self.assertEqual(docker_argv('ps'), ['/usr/bin/docker', '--host', 'unix:///run/docker.sock', 'ps'])
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False)
+class DockerLogIndexTest(DockerTestMixin, TestCase):
+    def setUp(self):
+        self.use_data_dir()
+
+    def make_container(self, container_id, name):
+        container = MagicMock(id=container_id)
+        container.name = name
+        return container
+
+    def test_index_and_search(self):
+        from modules.docker import logindex
+        logs = {
+            'aaa111': [
+                "2026-10-19T08:00:01.000000000Z GET /health 200",
+                "2026-10-19T08:30:00.000000000Z ERROR database timeout",
+                "2026-10-19T09:05:00.000000000Z ERROR cache miss storm",
+            ],
+            'bbb222': ["2026-10-19T08:45:00.000000000Z ERROR database refused"],
+        }
+        windows = []
+
+        def read_logs(container_id, since, until):
+            # Like docker, both ends are inclusive at second granularity
+            windows.append((since, until))
+            return [line for line in logs[container_id] if since <= logindex._to_epoch(line) <= until]
+        api, web = self.make_container('aaa111', 'api'), self.make_container('bbb222', 'web')
+        now = logindex._to_epoch('2026-10-19T09:05:30')
+        with patch('modules.docker.logindex.DockerCLI') as mock_docker, patch.object(logindex, '_read_logs', side_effect=read_logs), \
+                patch('modules.docker.logindex.time.time', return_value=now):
+            mock_docker.return_value.containers.list.return_value = [api, web]
+            logindex.index_all()
+            # The day before the first pass is read an hour at a time
+            self.assertEqual(windows[0], (now - logindex.INITIAL_WINDOW, logindex._to_epoch('2026-10-18T10:00:00')))
+            self.assertTrue(all(until - since <= 3600 for since, until in windows))
+
+            # The next pass starts at the watermark's second; only the new line is indexed
+            logs['aaa111'].append("2026-10-19T09:05:20.000000000Z ERROR database timeout again")
+            windows.clear()
+            logindex.index_all()
+            self.assertIn((logindex._to_epoch('2026-10-19T09:05:00'), now), windows)
+
+        results = logindex.search('error database')
+        self.assertEqual([(r['container'], r['line']) for r in results], [
+            ('api', 'ERROR database timeout again'),
+            ('web', 'ERROR database refused'),
+            ('api', 'ERROR database timeout'),
+        ])
+        self.assertEqual(len(logindex.search('storm')), 1)
+        self.assertEqual(len(logindex.search('database', containers=['web'])), 1)
+        self.assertEqual(len(logindex.search('database', containers=['aaa'])), 2)
+        self.assertEqual(len(logindex.search('error', since='2026-10-19T08:40', until='2026-10-19T09:05:00')), 2)
+
+    def test_backlog_is_written_in_batches(self):
+        import os
+        from modules.docker import logindex
+        lines = [f"2026-10-19T08:00:{n:02d}.000000000Z line {n}" for n in range(5)]
+        container = self.make_container('aaa111', 'api')
+        read_logs = lambda container_id, since, until: [line for line in lines if since <= logindex._to_epoch(line) <= until]
+        with patch.object(logindex, '_read_logs', side_effect=read_logs) as mock_read, patch.object(logindex, 'BATCH_LINES', 2), \
+                patch.object(logindex, '_append_segment', wraps=logindex._append_segment) as mock_append, \
+                patch('modules.docker.logindex.time.time', return_value=logindex._to_epoch('2026-10-19T08:30:00')):
+            newest = logindex.index_container(os.path.join(self.data_dir, 'logs'), container, '2026-10-19T07:59:59')
+        self.assertEqual([c.args[1:] for c in mock_read.call_args_list], [
+            (logindex._to_epoch('2026-10-19T07:59:59'), logindex._to_epoch('2026-10-19T08:00:00')),
+            (logindex._to_epoch('2026-10-19T08:00:00'), logindex._to_epoch('2026-10-19T08:30:00')),
+        ])
+        self.assertEqual(newest, lines[-1].split()[0])
+        # The line at the window boundary is read twice but stored once
+        self.assertEqual([len(c.args[3]) for c in mock_append.call_args_list], [1, 2, 2])
+
+    def test_passes_append_to_the_hour_index(self):
+        import os
+        from modules.docker import logindex
+        bucket_dir = os.path.join(self.data_dir, 'logs', '2026101908')
+        os.makedirs(bucket_dir)
+        logindex._append_segment(bucket_dir, 'aaa111', 'api', ['2026-10-19T08:00:01Z ERROR disk full'])
+        logindex._append_segment(bucket_dir, 'bbb222', 'db', ['2026-10-19T08:00:02Z ERROR disk_quota'])
+        logindex._append_segment(bucket_dir, 'aaa111', 'api-2', ['2026-10-19T08:00:02Z GET /', '2026-10-19T08:00:03Z ERROR disk full again'])
+        self.assertEqual(sorted(os.listdir(bucket_dir))[:3], ['aaa111.log.gz', 'bbb222.log.gz', 'index.sqlite'])
+        self.assertEqual([(r['container'], r['line']) for r in logindex.search('disk')], [
+            ('api-2', 'ERROR disk full again'), ('api-2', 'ERROR disk full'),
+        ])
+        self.assertEqual([r['line'] for r in logindex.search('disk_quota')], ['ERROR disk_quota'])
+        self.assertEqual(len(logindex.search('', containers=['api-2'])), 3)
+        self.assertEqual(len(logindex.search('', limit=2)), 2)
+        self.assertEqual(sorted(r['line'] for r in logindex.search('', since='2026-10-19T08:00:02', until='2026-10-19T08:00:02')),
+                         ['ERROR disk_quota', 'GET /'])
+        # Query text is matched as tokens, never as FTS5 syntax
+        self.assertEqual(logindex.search('disk OR NOT "full'), [])
+
+    def test_search_latency(self):
+        """A rare token across 100 containers and a day of hourly buckets is found well under a second.
+
+        Lines per container and hour default to a size that keeps the suite fast;
+        DOCKER_LOG_BENCHMARK_LINES=2000 builds the full day the search is sized for.
+        """
+        import os
+        from modules.docker import logindex
+        lines_per_hour = int(os.environ.get('DOCKER_LOG_BENCHMARK_LINES', 20))
+        words = ['GET', 'POST', 'health', 'user', 'db', 'timeout', 'ok', 'cache', 'miss', 'served', 'worker']
+        root = os.path.join(self.data_dir, 'logs')
+        for hour in range(24):
+            bucket_dir = os.path.join(root, f"20261019{hour:02d}")
+            os.makedirs(bucket_dir)
+            for c in range(100):
+                logindex._append_segment(bucket_dir, f"c{c:03d}", f"svc{c}", [
+                    f"2026-10-19T{hour:02d}:{n * 60 // lines_per_hour:02d}:{n % 60:02d}.000000000Z "
+                    f"{words[n % 11]} {words[(n + c) % 11]} id{hour}{c:03d}{n:04d} req-{hash((hour, c, n)) & 0xffffffffff:010x}"
+                    for n in range(lines_per_hour)
+                ])
+        for query, expected in (('id70420007', 1), ('req-deadbeef00', 0), ('timeout cache', 200), ('', 200)):
+            started = time.monotonic()
+            results = logindex.search(query)
+            elapsed = time.monotonic() - started
+            self.assertEqual(len(results), expected)
+            self.assertLess(elapsed, 0.5, f"search for {query!r} took {elapsed:.3f}s")
+
+    def test_search_view(self):
+        self.login()
+        with patch('modules.docker.views.logindex.search', return_value=[{'time': 't', 'container': 'api', 'line': 'x'}]) as mock_search:
+            response = self.client.get(reverse('docker_logs_search') + '?q=error&container=api&since=2026-10-19')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        mock_search.assert_called_with('error', containers=['api'], since='2026-10-19', until=None, limit=200)
+
+class DockerEventTest(DockerTestMixin, TestCase):
+    def event_line(self, seconds, action='start', actor='abc123', name='web', type_='container'):
+        return json.dumps({
+            'Type': type_, 'Action': action, 'timeNano': seconds * 1_000_000_000,
+            'Actor': {'ID': actor, 'Attributes': {'name': name, 'image': 'nginx'}},
+        }).encode()
+
+    def test_buffer_batches_and_skips_already_stored_events(self):
+        from datetime import datetime, timezone as dt_timezone
+        from modules.docker.events import EventBuffer
+        from modules.docker.models import DockerEvent
+        watermark = datetime.fromtimestamp(1_700_000_000, tz=dt_timezone.utc)
+        DockerEvent.objects.create(time=watermark, type='container', action='start', actor_id='abc123')
+        buffer = EventBuffer()
+        # A restarted stream replays the watermark's second
+        buffer.add(self.event_line(1_700_000_000))
+        # Same second as the watermark but not stored yet
+        buffer.add(self.event_line(1_700_000_000, actor='def456', name='db'))
+        buffer.add(b'not json')
+        for i in range(1, 4):
+            buffer.add(self.event_line(1_700_000_000 + i, action='die'))
+        self.assertEqual(DockerEvent.objects.count(), 1)
+        with self.assertNumQueries(1):
+            buffer.flush()
+        self.assertEqual(DockerEvent.objects.count(), 5)
+        self.assertEqual(DockerEvent.objects.filter(time=watermark).count(), 2)
+        event = DockerEvent.objects.filter(action='die').first()
+        self.assertEqual((event.type, event.action, event.actor_id, event.actor_name), ('container', 'die', 'abc123', 'web'))
+        self.assertEqual(event.attributes['image'], 'nginx')
+
+        # A second consumer writing the same events adds only the new one
+        other = EventBuffer()
+        other.add(self.event_line(1_700_000_003, action='die'))
+        other.add(self.event_line(1_700_000_003, action='destroy'))
+        other.flush()
+        self.assertEqual(DockerEvent.objects.count(), 6)
+
+    def test_workers_not_started_by_loading_the_app(self):
+        from django.apps import apps
+        from django.core.signals import request_started
+        from modules.docker import jobs
+        with patch.object(jobs, 'start_workers') as mock_start:
+            apps.get_app_config('docker_module').ready()
+            request_started.send(sender=self.__class__)
+        mock_start.assert_not_called()
+
+    @override_settings(DOCKER_IN_PROCESS_WORKERS=True)
+    def test_in_process_workers_start_with_requests(self):
+        from django.apps import apps
+        from django.core.signals import request_started
+        from modules.docker import jobs
+        self.addCleanup(request_started.disconnect, dispatch_uid='docker_start_workers')
+        with patch.object(jobs, 'start_workers') as mock_start:
+            apps.get_app_config('docker_module').ready()
+            mock_start.assert_not_called()
+            request_started.send(sender=self.__class__)
+        mock_start.assert_called_once_with()
+
+    def test_worker_command_keeps_jobs_running(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from modules.docker import events, jobs, updates
+        self.assertIn(('events', events.consume, events.RESTART_DELAY), jobs.worker_jobs())
+        self.assertIn(('image-updates', updates.run_update_check, updates.CHECK_INTERVAL), jobs.worker_jobs())
+        runs = []
+
+        def consume():
+            runs.append(threading.current_thread().name)
+            if len(runs) == 1:
+                raise RuntimeError("docker events stream closed")
+            raise SystemExit
+
+        out = StringIO()
+        with patch.object(jobs, 'worker_jobs', return_value=[('events', consume, 0)]), patch.object(jobs, '_workers', {}):
+            call_command('docker_worker', stdout=out)
+        # The failed run is retried; the command returns once its workers end
+        self.assertEqual(runs, ['docker-events', 'docker-events'])
+        self.assertIn('docker-events', out.getvalue())
+
+    def test_workers_start_once_per_process(self):
+        from modules.docker import jobs
+        release = threading.Event()
+
+        def consume():
+            release.wait(5)
+            raise SystemExit
+
+        with patch.object(jobs, 'worker_jobs', return_value=[('events', consume, 0)]), patch.object(jobs, '_workers', {}):
+            [thread] = jobs.start_workers()
+            self.assertEqual(jobs.start_workers(), [thread])
+            release.set()
+            thread.join(5)
+
+    def test_retention(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from modules.docker.events import apply_retention
+        from modules.docker.models import DockerEvent
+        now = timezone.now()
+        DockerEvent.objects.create(time=now - timedelta(days=40), type='container', action='die', actor_id='old')
+        DockerEvent.objects.create(time=now, type='container', action='die', actor_id='new')
+        self.assertEqual(apply_retention(days=30), 1)
+        self.assertEqual(list(DockerEvent.objects.values_list('actor_id', flat=True)), ['new'])
+
+    def test_timeline_keyset_pagination(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from modules.docker.events import timeline
+        from modules.docker.models import DockerEvent
+        now = timezone.now()
+        DockerEvent.objects.bulk_create([
+            DockerEvent(time=now - timedelta(seconds=i // 2), type='container', action=('die', 'restart')[i % 2],
+                        actor_id='web' if i % 3 else 'db')
+            for i in range(10)
+        ])
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = timeline(container='web', cursor=cursor, limit=2)
+            seen += page
+            if not cursor:
+                break
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(len({e.id for e in seen}), 6)
+        self.assertEqual(seen, sorted(seen, key=lambda e: (e.time, e.id), reverse=True))
+
+    def test_events_view(self):
+        from django.utils import timezone
+        from modules.docker.models import DockerEvent
+        Tool.objects.create(name="docker", status="installed")
+        self.login()
+        DockerEvent.objects.create(time=timezone.now(), type='container', action='oom', actor_id='abc123', actor_name='db')
+        DockerEvent.objects.create(time=timezone.now(), type='image', action='delete', actor_id='sha256:1')
+        response = self.client.get(reverse('docker_events') + '?container=db')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'oom')
+        self.assertNotContains(response, 'sha256:1')
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False, DOCKER_CLI=['docker'])
+class DockerContainerFilesTest(DockerTestMixin, TestCase):
+    def setUp(self):
+        self.login()
+
+    def tar_of(self, files):
+        import io, tarfile
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as archive:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
+
+    @patch('modules.docker.aio.run', new_callable=AsyncMock)
+    def test_list_directory(self, mock_run):
+        mock_run.return_value = (
+            b"total 8\n"
+            b"drwxr-xr-x    2 0        0             4096 Oct 19 08:00 conf.d\n"
+            b"-rw-r--r--    1 0        0             1234 Oct 19 08:00 nginx.conf\n"
+            b"lrwxrwxrwx    1 0        0               22 Oct 19 08:00 mime -> /usr/share/mime.types\n"
+            b"crw-rw-rw-    1 0        0           1,   3 Oct 19 08:00 null\n"
+            b"brw-rw----    1 0        6           7,0 Oct 19 08:00 loop0\n"
+        )
+        response = self.client.get(reverse('docker_container_files', kwargs={'container_id': 'abc123'}) + '?path=/etc/nginx/')
+        mock_run.assert_awaited_with(['docker', 'exec', 'abc123', 'ls', '-lAn', '--', '/etc/nginx'])
+        entries = response.context['entries']
+        self.assertEqual([e['name'] for e in entries], ['conf.d', 'loop0', 'mime', 'nginx.conf', 'null'])
+        self.assertEqual(entries[3]['size'], 1234)
+        self.assertEqual((entries[4]['device'], entries[4]['size'], entries[4]['modified']), ('1, 3', None, 'Oct 19 08:00'))
+        self.assertEqual((entries[1]['device'], entries[1]['modified']), ('7,0', 'Oct 19 08:00'))
+        self.assertEqual(entries[2]['target'], '/usr/share/mime.types')
+        self.assertEqual(entries[0]['path'], '/etc/nginx/conf.d')
+
+    async def test_download_streams_archive(self):
+        import gzip
+        long_name = 'data/' + 'n' * 150 + '.sql'
+        archive = self.tar_of({long_name: b'x' * 300000})
+        url = reverse('docker_container_file_download', kwargs={'container_id': 'abc123'})
+
+        docker = self.fake_docker(archive)
+        response = await self.async_client.get(url + '?path=/data/dump.sql&format=raw')
+        self.assertTrue(response.is_async)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'x' * 300000)
+        self.assertEqual(docker.argv, ['cp', 'abc123:/data/dump.sql', '-'])
+
+        self.fake_docker(archive)
+        response = await self.async_client.get(url + '?path=/data&format=gz')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="data.tar.gz"')
+        self.assertEqual(gzip.decompress(b''.join([chunk async for chunk in response.streaming_content])), archive)
+
+    async def test_download_of_missing_path_is_404(self):
+        self.fake_docker(stderr='Error response from daemon: Could not find the file /nope in container abc123', returncode=1)
+        url = reverse('docker_container_file_download', kwargs={'container_id': 'abc123'})
+        response = await self.async_client.get(url + '?path=/nope')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(b'Could not find the file /nope', response.content)
+
+    def test_download_streams_through_asgi_handler(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from django.conf import settings
+        from django.core.handlers.asgi import ASGIHandler
+        from django.core.signals import request_finished, request_started
+        from django.db import close_old_connections
+        # As the test client does, keep the handler from closing the test transaction's connection
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+        # The second half of the archive is only produced once the first half reached the
+        # client, which cannot happen if the response is collected before sending
+        docker = self.fake_docker(b'a' * 100000, b'b' * 100000, gated=True)
+        url = reverse('docker_container_file_download', kwargs={'container_id': 'abc123'})
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': url, 'raw_path': url.encode(), 'root_path': '', 'query_string': b'path=/data&format=tar',
+            'headers': [(b'host', b'testserver'), (b'cookie', f"{settings.SESSION_COOKIE_NAME}={session}".encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        messages = []
+
+        async def app():
+            requested = False
+            disconnected = asyncio.Event()
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.body' and message.get('body'):
+                    docker.open_gate()
+                messages.append(message)
+
+            await ASGIHandler()(scope, receive, send)
+        async_to_sync(app)()
+
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(m.get('body', b'') for m in messages[1:])
+        self.assertEqual(body, b'a' * 100000 + b'b' * 100000)
+
+    def test_upload_issues_single_use_url(self):
+        self.fake_docker()
+        url = reverse('docker_container_file_upload', kwargs={'container_id': 'abc123'}) + '?path=/tmp&name=config.yml'
+        upload_url = self.client.post(url).json()['upload_url']
+        self.assertTrue(upload_url.startswith('/docker/stream/upload/'))
+        status, _ = self.upload(upload_url, [b'key: value\n'], 'text/plain')
+        self.assertEqual(status, 200)
+        status, data = self.upload(upload_url, [b'key: value\n'], 'text/plain')
+        self.assertEqual(status, 403)
+
+    def test_upload_url_is_served_without_the_raw_asgi_route(self):
+        docker = self.fake_docker()
+        archive = self.tar_of({'a.txt': b'a'})
+        url = reverse('docker_container_file_upload', kwargs={'container_id': 'abc123'}) + '?path=/tmp'
+        response = self.client.post(self.client.post(url).json()['upload_url'], archive, content_type='application/x-tar')
+        self.assertEqual(response.json(), {'status': 'ok', 'path': '/tmp'})
+        self.assertEqual(docker.stdin, archive)
+        self.assertEqual(self.client.get(self.client.post(url).json()['upload_url']).status_code, 405)
+
+    def test_upload_wraps_single_file_in_tar(self):
+        import io, tarfile
+        docker = self.fake_docker()
+        url = reverse('docker_container_file_upload', kwargs={'container_id': 'abc123'}) + '?path=/tmp&name=config.yml'
+        upload_url = self.client.post(url).json()['upload_url']
+        # Each part only arrives once docker has read everything before it
+        status, data = self.upload(upload_url, [b'key: value\n', b'other: 1\n'], 'application/octet-stream',
+                                   wait_for=lambda sent: len(docker.stdin) >= tarfile.BLOCKSIZE + sum(map(len, sent)))
+        self.assertEqual((status, data), (200, {'status': 'ok', 'path': '/tmp'}))
+        self.assertEqual(docker.argv, ['cp', '-', 'abc123:/tmp'])
+        with tarfile.open(fileobj=io.BytesIO(docker.stdin)) as archive:
+            self.assertEqual(archive.getnames(), ['config.yml'])
+            self.assertEqual(archive.extractfile('config.yml').read(), b'key: value\nother: 1\n')
+
+    def test_upload_passes_tar_through(self):
+        docker = self.fake_docker(stderr='no such directory', returncode=1)
+        archive = self.tar_of({'a.txt': b'a'})
+        url = reverse('docker_container_file_upload', kwargs={'container_id': 'abc123'}) + '?path=/missing'
+        status, data = self.upload(self.client.post(url).json()['upload_url'], [archive], 'application/x-tar')
+        self.assertEqual(status, 500)
+        self.assertEqual(docker.stdin, archive)
+        self.assertIn('no such directory', data['error'])
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False, DOCKER_CLI=['docker'])
+class DockerVolumeBackupTest(DockerTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.use_data_dir()
+        self.login()
+        patcher = patch('modules.docker.views.DockerCLI')
+        volumes = [MagicMock() for _ in range(3)]
+        for volume, name in zip(volumes, ['a', 'b', 'pgdata']):
+            volume.name = name
+        patcher.start().return_value.volumes.list.return_value = volumes
+        self.addCleanup(patcher.stop)
+
+    @patch('modules.docker.streams.subprocess.Popen')
+    def test_backup_to_file_and_restore(self, mock_popen):
+        import gzip
+        from modules.docker import backups, streams
+        tar_data = b'tar-bytes' * 1000
+        mock_popen.return_value = FakeProcess(tar_data)
+        progress = streams.TransferProgress('backup', 'pgdata')
+        backups.backup_to_file('pgdata', progress)
+
+        self.assertIn('pgdata:/volume:ro', mock_popen.call_args[0][0])
+        [stored] = backups.list_backups()
+        path = backups.backup_path(stored['name'])
+        with open(path, 'rb') as f:
+            compressed = f.read()
+        self.assertEqual(gzip.decompress(compressed), tar_data)
+        self.assertEqual(stored['sha256'], hashlib.sha256(compressed).hexdigest())
+        job = backups.list_jobs()[0]
+        self.assertEqual((job['state'], job['bytes']), ('done', len(compressed)))
+
+        restore = FakeProcess()
+        mock_popen.return_value = restore
+        progress = streams.TransferProgress('restore', 'pgdata')
+        backups.restore_from_file('pgdata', stored['name'], progress)
+        self.assertEqual(restore.stdin.getvalue(), compressed)
+        self.assertEqual(cache.get(progress.key)['state'], 'done')
+
+    @patch('modules.docker.streams.subprocess.Popen')
+    def test_restore_refuses_corrupted_backup(self, mock_popen):
+        import os
+        from modules.docker import backups, streams
+        path = os.path.join(backups.backup_dir(), 'pgdata-1.tar.gz')
+        with open(path, 'wb') as f:
+            f.write(b'corrupted')
+        with open(path + '.sha256', 'w') as f:
+            f.write('0' * 64 + '  pgdata-1.tar.gz\n')
+        progress = streams.TransferProgress('restore', 'pgdata')
+        backups.restore_from_file('pgdata', 'pgdata-1.tar.gz', progress)
+        self.assertEqual(cache.get(progress.key)['state'], 'error')
+        mock_popen.assert_not_called()
+
+    def test_uploaded_restore_reports_checksum(self):
+        from modules.docker import backups
+        docker = self.fake_docker()
+        body = b'gzip-bytes' * 1000
+        url = reverse('docker_volume_restore', kwargs={'volume_name': 'pgdata'})
+        upload_url = self.client.post(url, {'upload': '1'}).json()['upload_url']
+        status, data = self.upload(upload_url, [body[:5000], body[5000:]], 'application/gzip')
+        self.assertEqual((status, data), (200, {'status': 'ok', 'sha256': hashlib.sha256(body).hexdigest()}))
+        self.assertEqual(docker.stdin, body)
+        self.assertEqual(docker.argv[:4], ['run', '--rm', '-i', '-v'])
+        [job] = backups.list_jobs()
+        self.assertEqual((job['kind'], job['state'], job['bytes']), ('restore', 'done', len(body)))
+
+    async def test_download_backup_streams(self):
+        import gzip
+        from modules.docker import backups
+        self.fake_docker(b'volume-tar')
+        url = reverse('docker_volume_backup', kwargs={'volume_name': 'pgdata'})
+        response = await self.async_client.post(url, {'target': 'download'})
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(gzip.decompress(body), b'volume-tar')
+        [job] = await sync_to_async(backups.list_jobs)()
+        self.assertEqual((job['kind'], job['state'], job['bytes']), ('backup', 'done', len(body)))
+        self.assertEqual(job['sha256'], hashlib.sha256(body).hexdigest())
+        self.assertIsNotNone(job['finished'])
+
+    async def test_cancelled_backup_download_is_finished(self):
+        import asyncio, os
+        from modules.docker import backups
+        # Random bytes so gzip has output before docker stops writing
+        self.fake_docker(os.urandom(200000), b'y', gated=True)
+        url = reverse('docker_volume_backup', kwargs={'volume_name': 'pgdata'})
+        response = await self.async_client.post(url, {'target': 'download'})
+
+        received = asyncio.Event()
+
+        async def download():
+            async for _ in response.streaming_content:
+                received.set()
+        # The handler cancels the response task when the client disconnects
+        task = asyncio.ensure_future(download())
+        await received.wait()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        [job] = await sync_to_async(backups.list_jobs)()
+        self.assertEqual((job['state'], job['error']), ('error', 'Download cancelled'))
+
+    @patch('modules.docker.views.backups.submit_backup')
+    def test_backup_many(self, mock_submit):
+        response = self.client.post(reverse('docker_volume_backup_many'), {'volumes': ['a', '/etc', 'missing', 'b']})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual([c.args[0] for c in mock_submit.call_args_list], ['a', 'b'])
+
+    @patch('modules.docker.streams.subprocess.Popen')
+    def test_only_existing_volumes_are_mounted(self, mock_popen):
+        from modules.docker import backups
+        for view in ('docker_volume_backup', 'docker_volume_restore'):
+            response = self.client.post(reverse(view, kwargs={'volume_name': 'missing'}), {'upload': '1', 'backup': 'x.tar.gz'})
+            self.assertEqual(response.status_code, 404)
+        for volume in ('/etc', '.', '../x', 'data:/host', ''):
+            with self.assertRaises(ValueError):
+                backups._backup_args(volume)
+            with self.assertRaises(ValueError):
+                backups._restore_args(volume)
+        mock_popen.assert_not_called()
+        self.assertEqual(backups.list_jobs(), [])
+
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False, DOCKER_CLI=['docker'])
+class DockerImageArchiveTest(DockerTestMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.login()
+
+    async def test_save_streams_one_archive_for_many_images(self):
+        import gzip
+        from modules.docker import imagearchive
+        docker = self.fake_docker(b'image-tar' * 1000)
+        response = await self.async_client.get(reverse('docker_image_save') + '?images=nginx:latest+nginx:1.27&images=redis:7&format=gz')
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="images.tar.gz"')
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(gzip.decompress(body), b'image-tar' * 1000)
+        self.assertEqual(docker.argv, ['save', 'nginx:latest', 'nginx:1.27', 'redis:7'])
+        job = (await sync_to_async(imagearchive.list_transfers)())[0]
+        self.assertEqual((job['kind'], job['state'], job['bytes']), ('save', 'done', len(body)))
+
+    async def test_save_rejects_unknown_image_and_format(self):
+        import os
+        docker = self.fake_docker(stderr='No such image: nope', returncode=1)
+        response = await self.async_client.get(reverse('docker_image_save') + '?images=nope')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(b'No such image', response.content)
+        self.assertEqual(docker.argv, ['image', 'inspect', 'nope'])
+        os.remove(docker.spec_path + '.argv')
+        response = await self.async_client.get(reverse('docker_image_save') + '?images=nginx&format=rar')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(os.path.exists(docker.spec_path + '.argv'))
+
+    def test_load_pipes_body_into_docker_load(self):
+        docker = self.fake_docker(b'Loaded image: nginx:latest\nLoaded image: redis:7\n')
+        archive = b'archive' * 50000
+        upload_url = self.client.post(reverse('docker_image_load') + '?name=images.tar').json()['upload_url']
+        status, data = self.upload(upload_url, [archive[:100000], archive[100000:]], 'application/x-tar')
+        self.assertEqual(status, 200)
+        self.assertEqual(data['images'], ['nginx:latest', 'redis:7'])
+        self.assertEqual(data['bytes'], len(archive))
+        self.assertEqual(docker.stdin, archive)
+        self.assertEqual(docker.argv, ['load'])
+
+    def test_load_reports_docker_errors(self):
+        self.fake_docker(stderr='unexpected EOF', returncode=1)
+        upload_url = self.client.post(reverse('docker_image_load')).json()['upload_url']
+        status, data = self.upload(upload_url, [b'garbage'], 'application/x-tar')
+        self.assertEqual(status, 500)
+        self.assertIn('unexpected EOF', data['error'])
+
+@override_settings(DOCKER_BACKGROUND_JOBS=False)
+class DockerInstallTest(TestCase):
+    def setUp(self):
+        self.tool = Tool.objects.create(name="docker", status="installing")
+
+    def probe_result(self, installed):
+        def dpkg_query(cmd, **kwargs):
+            lines = [f"{pkg} install ok installed" for pkg in cmd[4:] if pkg in installed]
+            return subprocess.CompletedProcess(cmd, 0, stdout='\n'.join(lines).encode())
+        return dpkg_query
+
+    @patch('modules.docker.install.os.path.getsize', return_value=100)
+    @patch('modules.docker.install.os.path.isfile', return_value=True)
+    @patch('modules.docker.install.subprocess.run')
+    @patch('modules.docker.install.run_command')
+    def test_satisfied_host_skips_every_stage(self, mock_run, mock_query, mock_isfile, mock_getsize):
+        from modules.docker import install
+        mock_query.side_effect = self.probe_result(install.DEPENDENCIES + install.DOCKER_PACKAGES)
+        install.run_pipeline(self.tool.pk)
+        mock_run.assert_not_called()
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.status, 'installed')
+        stages = self.tool.config_data['install']['stages']
+        self.assertEqual(len(stages), 7)
+        self.assertTrue(all(stage['status'] == 'skipped' for stage in stages.values()))
+
+    @patch('modules.docker.install.os.path.isfile', return_value=False)
+    @patch('modules.docker.install.subprocess.run')
+    @patch('modules.docker.install.run_command')
+    def test_retry_resumes_from_failed_stage(self, mock_run, mock_query, mock_isfile):
+        from modules.docker import install
+        mock_query.side_effect = self.probe_result([])
+        commands = []
+
+        def run(command, **kwargs):
+            commands.append(command)
+            if 'download.docker.com' in command and 'gpg' in command:
+                raise Exception('curl: (6) Could not resolve host')
+            return b'ok\n'
+        mock_run.side_effect = run
+
+        install.run_pipeline(self.tool.pk)
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.status, 'error')
+        state = self.tool.config_data['install']
+        self.assertEqual(state['failed_stage'], 'gpg_key')
+        self.assertEqual(state['stages']['install_dependencies']['output'], 'ok\n')
+        self.assertIn('Could not resolve host', state['stages']['gpg_key']['output'])
+        # No conflicting packages are installed, so their removal is skipped
+        self.assertEqual(state['stages']['remove_conflicts']['status'], 'skipped')
+        self.assertEqual(len(commands), 3)
+
+        commands.clear()
+        mock_run.side_effect = lambda command, **kwargs: commands.append(command) or b''
+        install.run_pipeline(self.tool.pk)
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.status, 'installed')
+        self.assertNotIn('error_log', self.tool.config_data)
+        self.assertIn('gpg', commands[0])
+        self.assertEqual(len(commands), 4)
+        self.assertEqual(self.tool.config_data['install']['stages']['update_apt']['status'], 'done')
+
+    @patch('modules.docker.install.subprocess.run')
+    @patch('modules.docker.install.run_command')
+    def test_offline_mode_installs_local_debs(self, mock_run, mock_query):
+        import os, tempfile, shutil
+        from modules.docker import install
+        deb_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, deb_dir)
+        open(os.path.join(deb_dir, 'docker-ce.deb'), 'wb').close()
+        mock_query.side_effect = self.probe_result([])
+        mock_run.return_value = b''
+        with override_settings(DOCKER_OFFLINE_DEB_DIR=deb_dir):
+            install.run_pipeline(self.tool.pk)
+        self.tool.refresh_from_db()
+        self.assertEqual(self.tool.config_data['install']['mode'], 'offline')
+        mock_run.assert_called_once()
+        self.assertIn(f"{deb_dir}/*.deb", mock_run.call_args[0][0])
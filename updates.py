@@ -0,0 +1,142 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from django.core.cache import cache
+from django.utils import timezone
+from core.docker_cli_wrapper import DockerCLI
+
+from .models import DockerRegistry
+from .registry import RegistryClient, normalize_registry_url, parse_image_reference
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 3600
+# Each check revalidates the oldest slice of cached digests, so all of them
+# are refreshed within REFRESH_RUNS checks, before DIGEST_TTL runs out
+REFRESH_RUNS = 5
+DIGEST_TTL = CHECK_INTERVAL * (REFRESH_RUNS + 1)
+RESULTS_KEY = 'docker_image_updates'
+MAX_REGISTRIES = 4
+WORKERS_PER_REGISTRY = 4
+REQUESTS_PER_SECOND = 5
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads sharing it."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _digest_key(base_url, repository, tag):
+    return f"docker_remote_digest:{base_url}/{repository}:{tag}"
+
+
+def group_image_tags(images):
+    """Groups every local tag by registry as {base_url: {(repository, tag): [(name, local digests)]}}."""
+    groups = {}
+    for image in images:
+        repo_digests = image.attrs.get('RepoDigests') or []
+        for name in image.tags:
+            familiar = name.rsplit(':', 1)[0] if ':' in name.rsplit('/', 1)[-1] else name
+            local = {d.split('@', 1)[1] for d in repo_digests if d.split('@', 1)[0] == familiar}
+            if not local:
+                # Locally built or loaded images have nothing to compare against
+                continue
+            base_url, repository, tag = parse_image_reference(name)
+            groups.setdefault(base_url, {}).setdefault((repository, tag), []).append((name, local))
+    return groups
+
+
+def resolve_digests(client, refs, refresh=False):
+    """Resolves remote digests for one registry, using cached values while they are fresh.
+
+    Besides tags that are not cached yet, each call revalidates the oldest
+    1/REFRESH_RUNS of the cached ones, so every digest is refreshed before
+    it expires without the whole registry being queried on the same run.
+    With `refresh` every digest is fetched again.
+    """
+    digests = {}
+    missing = []
+    cached = []
+    for repository, tag in refs:
+        entry = None if refresh else cache.get(_digest_key(client.base_url, repository, tag))
+        if isinstance(entry, dict):
+            digests[(repository, tag)] = entry['digest']
+            cached.append((entry['checked_at'], (repository, tag)))
+        else:
+            missing.append((repository, tag))
+    cached.sort()
+    missing += [ref for _, ref in cached[:math.ceil(len(cached) / REFRESH_RUNS)]]
+
+    limiter = RateLimiter(REQUESTS_PER_SECOND)
+
+    def head(ref):
+        limiter.wait()
+        try:
+            return ref, client.head_digest(*ref)
+        except Exception as e:
+            logger.warning(f"Digest lookup failed for {client.host}/{ref[0]}:{ref[1]}: {e}")
+            return ref, None
+
+    with ThreadPoolExecutor(max_workers=WORKERS_PER_REGISTRY) as pool:
+        for ref, digest in pool.map(head, missing):
+            # A failed revalidation keeps the cached digest until it expires
+            if digest:
+                digests[ref] = digest
+                cache.set(_digest_key(client.base_url, *ref), {'digest': digest, 'checked_at': time.time()}, DIGEST_TTL)
+    return digests
+
+
+def check_image_updates(images, registries=(), refresh=False):
+    """Compares local RepoDigests with the registries and caches the tags that are stale."""
+    # Match by host so registries configured with plain http keep their scheme
+    credentials = {urlparse(normalize_registry_url(r.url)).netloc: r for r in registries}
+    groups = group_image_tags(images)
+
+    def check_registry(base_url):
+        registry = credentials.get(urlparse(base_url).netloc)
+        client = RegistryClient.for_registry(registry) if registry else RegistryClient(base_url)
+        return base_url, resolve_digests(client, groups[base_url], refresh)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=MAX_REGISTRIES) as pool:
+        for base_url, digests in pool.map(check_registry, list(groups)):
+            for ref, entries in groups[base_url].items():
+                remote = digests.get(ref)
+                if not remote:
+                    continue
+                for name, local in entries:
+                    results[name] = {'remote_digest': remote, 'update_available': remote not in local}
+    cache.set(RESULTS_KEY, {'checked_at': timezone.now(), 'tags': results}, CHECK_INTERVAL * 4)
+    return results
+
+
+def get_update_status():
+    return cache.get(RESULTS_KEY) or {'checked_at': None, 'tags': {}}
+
+
+def stale_image_ids(images):
+    """Returns ids of local images with at least one tag whose remote digest moved."""
+    tags = get_update_status()['tags']
+    return {img.id for img in images if any(tags.get(t, {}).get('update_available') for t in img.tags)}
+
+
+def run_update_check(refresh=False):
+    """Entry point of the image-updates worker job: checks every tagged local image."""
+    client = DockerCLI()
+    return check_image_updates(client.images.list(), list(DockerRegistry.objects.all()), refresh)
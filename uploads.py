@@ -0,0 +1,167 @@
+import json
+import logging
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import backups
+from . import imagearchive
+from . import streams
+
+logger = logging.getLogger(__name__)
+
+TICKET_TTL = 300
+UPLOAD_PREFIX = '/docker/stream/upload/'
+ARCHIVE_TYPES = ('application/x-tar', 'application/gzip', 'application/x-gzip')
+
+# The regular views check login and CSRF and hand out a single-use ticket;
+# the body is then POSTed to UPLOAD_PREFIX<ticket>/ and piped into docker.
+# Django's ASGI handler spools a request body to a temporary file before any
+# view runs, so `application` is a raw ASGI app that reads the body as the
+# server receives it. It is returned by Module.get_http_urls() for routers
+# that mount it ahead of Django; `upload_view` serves the same URL through
+# Django's own routing everywhere else.
+
+
+def create_ticket(kind, **params):
+    """Returns the URL one raw upload body may be POSTed to within TICKET_TTL seconds."""
+    ticket = secrets.token_urlsafe(24)
+    cache.set(f"docker_upload:{ticket}", {'kind': kind, 'params': params}, TICKET_TTL)
+    return f"{UPLOAD_PREFIX}{ticket}/"
+
+
+async def _claim(ticket):
+    key = f"docker_upload:{ticket}"
+    upload = await cache.aget(key)
+    # Whoever deletes the entry owns the ticket
+    if upload is None or not await cache.adelete(key):
+        return None
+    return upload
+
+
+async def _body(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise IOError("Upload aborted by the client")
+        if message.get('body'):
+            yield message['body']
+        if not message.get('more_body', False):
+            return
+
+
+async def _request_body(request):
+    read = sync_to_async(request.read, thread_sensitive=False)
+    while True:
+        chunk = await read(streams.CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _content_type(value):
+    return (value or '').split(';')[0].strip()
+
+
+def _length(value):
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+async def _handle(ticket, chunks, length, content_type):
+    upload = await _claim(ticket)
+    if upload is None:
+        return 403, {'error': 'Invalid or expired upload ticket'}
+    try:
+        return await HANDLERS[upload['kind']](chunks, length, content_type, **upload['params'])
+    except IOError as e:
+        return 400, {'error': str(e)}
+
+
+async def _respond(send, status, data):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def container_files(chunks, length, content_type, container_id, path, name=''):
+    """Extracts tar (optionally compressed) uploads into `path`; any other body is stored as `path`/`name`."""
+    if content_type not in ARCHIVE_TYPES:
+        if not name:
+            return 400, {'error': 'A file name is required'}
+        if not length:
+            return 411, {'error': 'Content-Length is required'}
+        chunks = streams.atar_single_file(name, length, chunks)
+    returncode, output = await streams.apipe(['cp', '-', f"{container_id}:{path}"], chunks, f"Upload to {container_id}:{path}")
+    if returncode:
+        return 500, {'error': output or 'docker cp failed'}
+    return 200, {'status': 'ok', 'path': path}
+
+
+async def volume_restore(chunks, length, content_type, volume):
+    """Extracts an uploaded .tar.gz into the volume."""
+    progress = await sync_to_async(streams.TransferProgress)('restore', volume)
+    try:
+        checksum = await backups.arestore_stream(volume, chunks, progress)
+    except IOError as e:
+        return 500, {'error': str(e)}
+    # An uploaded stream can only be hashed as it is extracted, so the
+    # checksum is reported for the client to compare, not enforced
+    return 200, {'status': 'ok', 'sha256': checksum}
+
+
+async def image_load(chunks, length, content_type, name):
+    """Loads the images in an uploaded archive; docker load detects the compression."""
+    progress = await sync_to_async(streams.TransferProgress)('load', name)
+    try:
+        loaded = await imagearchive.load_stream(chunks, progress)
+    except IOError as e:
+        return 500, {'error': str(e)}
+    elapsed = progress.data['finished'] - progress.data['started']
+    return 200, {
+        'status': 'ok', 'images': loaded, 'bytes': progress.data['bytes'],
+        'rate': progress.data['bytes'] / elapsed if elapsed > 0 else 0,
+    }
+
+
+HANDLERS = {
+    'container_files': container_files,
+    'volume_restore': volume_restore,
+    'image_load': image_load,
+}
+
+
+async def application(scope, receive, send):
+    """Raw ASGI endpoint for UPLOAD_PREFIX<ticket>/."""
+    if scope['type'] != 'http':
+        raise ValueError(f"Uploads are HTTP only, not {scope['type']}")
+    if scope['method'] != 'POST':
+        return await _respond(send, 405, {'error': 'POST required'})
+    headers = {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', [])}
+    ticket = scope['path'].rstrip('/').rsplit('/', 1)[-1]
+    status, data = await _handle(ticket, _body(receive), _length(headers.get('content-length')),
+                                 _content_type(headers.get('content-type')))
+    await _respond(send, status, data)
+
+
+@csrf_exempt
+async def upload_view(request, ticket):
+    """UPLOAD_PREFIX<ticket>/ as a Django view; the ticket stands in for the CSRF token.
+
+    Under WSGI the body is read from the socket as it arrives; under ASGI
+    Django has already spooled it by the time this runs.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    status, data = await _handle(ticket, _request_body(request), _length(request.META.get('CONTENT_LENGTH')),
+                                 _content_type(request.META.get('CONTENT_TYPE')))
+    return JsonResponse(data, status=status)
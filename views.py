@@ -1,45 +1,65 @@
-import subprocess
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+import logging
+import os
+import posixpath
+import time
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.cache import cache
 from core.models import Tool
 from .models import DockerRegistry
 from django.contrib.auth.decorators import login_required
 from core.utils import run_command
 from core.docker_cli_wrapper import DockerCLI
+from .registry import RegistryClient, RegistryError, suggest_images
+from .jobs import run_periodically
+from . import updates
+from .compose import STACK_ACTIONS
+from . import logindex
+from . import events
+from . import streams
+from . import backups
+from . import imagearchive
+from . import aio
+from . import uploads
+
+logger = logging.getLogger(__name__)
+
+# Views that wait on the daemon are async: a slow stop or pull awaits its
+# subprocess instead of holding a worker, so the dashboard stays responsive.
 
 @login_required
-def container_action(request, container_id, action):
+async def container_action(request, container_id, action):
     try:
-        client = DockerCLI()
-        container = client.containers.get(container_id)
-        if action == 'start':
-            container.start()
-        elif action == 'stop':
-            container.stop()
-        elif action == 'restart':
-            container.restart()
-        elif action == 'remove':
-            container.remove(force=True)
+        await aio.container_action(container_id, action)
     except Exception:
         pass
     return redirect('tool_detail', tool_name='docker')
 
 @login_required
-def container_logs(request, container_id):
+async def docker_stack_action(request, project, action):
+    if action in STACK_ACTIONS:
+        try:
+            containers = await aio.project_containers(project)
+            errors = await aio.stack_action(containers, action)
+            for name, error in errors.items():
+                logger.error(f"Stack {project}: {action} {name} failed: {error}")
+        except Exception as e:
+            logger.error(f"Stack {project}: {action} failed: {e}")
+    return redirect('tool_detail', tool_name='docker')
+
+@login_required
+async def container_logs(request, container_id):
     try:
-        client = DockerCLI()
-        container = client.containers.get(container_id)
-        logs = container.logs(tail=200).decode('utf-8', errors='replace')
+        logs = (await aio.container_logs(container_id, tail=200)).decode('utf-8', errors='replace')
         return HttpResponse(logs)
     except Exception as e:
         return HttpResponse(f"Error: {str(e)}")
 
 @login_required
-def container_logs_download(request, container_id):
+async def container_logs_download(request, container_id):
     try:
-        client = DockerCLI()
-        container = client.containers.get(container_id)
-        logs = container.logs().decode('utf-8', errors='replace')
+        logs = (await aio.container_logs(container_id)).decode('utf-8', errors='replace')
         response = HttpResponse(logs, content_type='text/plain')
         response['Content-Disposition'] = f'attachment; filename="container_{container_id}_logs.log"'
         return response
@@ -47,18 +67,63 @@ def container_logs_download(request, container_id):
         return HttpResponse(f"Error downloading container logs: {str(e)}", status=500)
 
 @login_required
-def docker_service_logs(request):
+def docker_logs_search(request):
+    started = time.monotonic()
     try:
-        # Try journalctl without sudo first
-        try:
-            output = subprocess.check_output(['journalctl', '-u', 'docker', '-n', '200', '--no-pager'], stderr=subprocess.STDOUT).decode()
-            # If output contains the restriction hint, it's basically empty for us
-            if "Hint: You are currently not seeing messages" in output:
-                raise subprocess.CalledProcessError(1, 'journalctl')
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # Fallback to sudo if the first one fails or is restricted
-            output = run_command(['journalctl', '-u', 'docker', '-n', '200', '--no-pager']).decode()
-        
+        limit = min(int(request.GET.get('limit', logindex.MAX_RESULTS)), 1000)
+    except ValueError:
+        limit = logindex.MAX_RESULTS
+    try:
+        results = logindex.search(
+            request.GET.get('q', ''),
+            containers=request.GET.getlist('container') or None,
+            since=request.GET.get('since') or None,
+            until=request.GET.get('until') or None,
+            limit=limit,
+        )
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+    return JsonResponse({
+        'results': results,
+        'count': len(results),
+        'took_ms': round((time.monotonic() - started) * 1000, 1),
+    })
+
+@login_required
+def docker_events(request):
+    filters = {
+        'container': request.GET.get('container') or None,
+        'type': request.GET.get('type') or None,
+        'action': request.GET.get('action') or None,
+    }
+    page, next_cursor = events.timeline(cursor=request.GET.get('before'), **filters)
+    context = {
+        'events': page,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'event_types': events.EVENT_TYPES,
+        'tool': get_object_or_404(Tool, name='docker'),
+    }
+    return render(request, 'core/docker_events.html', context)
+
+async def _docker_journal(*args):
+    command = ['journalctl', '-u', 'docker', *args, '--no-pager']
+    # Try journalctl without sudo first
+    try:
+        output = (await aio.run(command, merge_stderr=True)).decode()
+        # If output contains the restriction hint, it's basically empty for us
+        if "Hint: You are currently not seeing messages" in output:
+            raise aio.CommandError(command, 1, output)
+    except (aio.CommandError, FileNotFoundError):
+        # Fallback to sudo if the first one fails or is restricted
+        output = (await sync_to_async(run_command, thread_sensitive=False)(command)).decode()
+    return output
+
+@login_required
+async def docker_service_logs(request):
+    try:
+        output = await _docker_journal('-n', '200')
+
         if not output.strip() or "No entries" in output:
             return HttpResponse("No log entries found. Ensure the 'docker' service is running and you have permissions to view logs (group 'systemd-journal' or 'adm').", content_type='text/plain')
             
@@ -67,17 +132,10 @@ def docker_service_logs(request):
         return HttpResponse(f"Error fetching system logs: {str(e)}", status=500)
 
 @login_required
-def docker_service_logs_download(request):
+async def docker_service_logs_download(request):
     try:
-        # Try journalctl without sudo first
-        try:
-            output = subprocess.check_output(['journalctl', '-u', 'docker', '--no-pager'], stderr=subprocess.STDOUT).decode()
-            if "Hint: You are currently not seeing messages" in output:
-                raise subprocess.CalledProcessError(1, 'journalctl')
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # Fallback to sudo if the first one fails or is restricted
-            output = run_command(['journalctl', '-u', 'docker', '--no-pager']).decode()
-        
+        output = await _docker_journal()
+
         response = HttpResponse(output, content_type='text/plain')
         response['Content-Disposition'] = 'attachment; filename="docker_service_logs.log"'
         return response
@@ -85,10 +143,10 @@ def docker_service_logs_download(request):
         return HttpResponse(f"Error downloading system logs: {str(e)}", status=500)
 
 @login_required
-def docker_container_config(request, container_id):
+async def docker_container_config(request, container_id):
     try:
         client = DockerCLI()
-        container = client.containers.get(container_id)
+        container = await sync_to_async(client.containers.get, thread_sensitive=False)(container_id)
         config = container.attrs
         
         if request.method == 'POST':
@@ -97,15 +155,15 @@ def docker_container_config(request, container_id):
             if action == 'connect_network':
                 net_id = request.POST.get('network_id')
                 if net_id:
-                    network = client.networks.get(net_id)
-                    network.connect(container)
+                    network = await sync_to_async(client.networks.get, thread_sensitive=False)(net_id)
+                    await sync_to_async(network.connect, thread_sensitive=False)(container)
                 return redirect('docker_container_config', container_id=container_id)
             
             elif action == 'disconnect_network':
                 net_id = request.POST.get('network_id')
                 if net_id:
-                    network = client.networks.get(net_id)
-                    network.disconnect(container)
+                    network = await sync_to_async(client.networks.get, thread_sensitive=False)(net_id)
+                    await sync_to_async(network.disconnect, thread_sensitive=False)(container)
                 return redirect('docker_container_config', container_id=container_id)
             
             # Default recreation logic
@@ -135,55 +193,131 @@ def docker_container_config(request, container_id):
                         target = parts[1]
                         mode = parts[2] if len(parts) > 2 else 'rw'
                         volume_dict[source] = {'bind': target, 'mode': mode}
-            container.stop()
-            container.remove()
-            
-            # Recreate container
-            client.containers.run(
-                image,
-                name=name,
-                environment=new_env,
-                volumes=volume_dict,
-                ports=port_dict,
-                network=new_network,
-                detach=True,
-                restart_policy={"Name": "always"}
-            )
+            async def recreate():
+                # Stopping waits out the container's grace period; await it rather than hold a worker
+                await aio.container_action(container.id, 'stop')
+                await aio.container_action(container.id, 'remove')
+                await sync_to_async(client.containers.run, thread_sensitive=False)(
+                    image,
+                    name=name,
+                    environment=new_env,
+                    volumes=volume_dict,
+                    ports=port_dict,
+                    network=new_network,
+                    detach=True,
+                    restart_policy={"Name": "always"}
+                )
+            # A client that goes away must not leave the container stopped or removed
+            await aio.detached(recreate())
             return redirect('tool_detail', tool_name='docker')
 
         context = {
             'container': container,
             'config': config,
-            'networks_list': client.networks.list(),
-            'tool': get_object_or_404(Tool, name='docker')
+            'networks_list': await sync_to_async(client.networks.list, thread_sensitive=False)(),
+            'tool': await aget_object_or_404(Tool, name='docker')
         }
-        return render(request, 'core/docker_container_config.html', context)
+        return await sync_to_async(render)(request, 'core/docker_container_config.html', context)
     except Exception as e:
         return HttpResponse(str(e), status=500)
 
+def _container_path(path):
+    return posixpath.normpath('/' + path.lstrip('/'))
+
+def _parse_ls(output, path):
+    entries = []
+    for line in output.splitlines():
+        head = line.split(None, 5)
+        # Device files show "major, minor" where the size would be, which is one field more
+        fields = 10 if line[:1] in ('c', 'b') and len(head) > 4 and head[4].endswith(',') else 9
+        parts = line.split(None, fields - 1)
+        if len(parts) < fields or line.startswith('total'):
+            continue
+        perms, name = parts[0], parts[-1]
+        target = None
+        if perms.startswith('l') and ' -> ' in name:
+            name, target = name.split(' -> ', 1)
+        is_device = perms[:1] in ('c', 'b')
+        entries.append({
+            'name': name,
+            'path': posixpath.join(path, name),
+            'is_dir': perms.startswith('d'),
+            'is_link': perms.startswith('l'),
+            'target': target,
+            'size': int(parts[4]) if not is_device and parts[4].isdigit() else None,
+            'device': ' '.join(parts[4:fields - 4]) if is_device else None,
+            'perms': perms,
+            'modified': ' '.join(parts[fields - 4:fields - 1]),
+        })
+    entries.sort(key=lambda e: (not e['is_dir'], e['name']))
+    return entries
+
 @login_required
-def docker_image_action(request, image_id, action):
+async def docker_container_files(request, container_id):
+    path = _container_path(request.GET.get('path', '/'))
+    context = {'container_id': container_id, 'path': path, 'parent': posixpath.dirname(path) if path != '/' else None}
+    try:
+        output = (await aio.docker('exec', container_id, 'ls', '-lAn', '--', path)).decode('utf-8', errors='replace')
+        context['entries'] = _parse_ls(output, path)
+    except Exception as e:
+        context['files_error'] = str(e)
+    return await sync_to_async(render)(request, 'core/partials/docker_container_files.html', context)
+
+@login_required
+async def docker_container_file_download(request, container_id):
+    path = _container_path(request.GET.get('path', '/'))
+    fmt = request.GET.get('format', 'gz')
+    name = posixpath.basename(path) or 'root'
+    # `docker cp CONTAINER:PATH -` streams the daemon's archive endpoint as a tar
+    output = streams.ProcessOutput(['cp', f"{container_id}:{path}", '-'], f"Download of {container_id}:{path}")
+    error = await output.start()
+    if error:
+        return HttpResponse(error, status=404, content_type='text/plain')
+    if fmt == 'raw':
+        output.pipe(streams.afirst_file)
+        filename, content_type = name, 'application/octet-stream'
+    elif fmt == 'tar':
+        filename, content_type = f"{name}.tar", 'application/x-tar'
+    else:
+        output.pipe(streams.agzip_chunks)
+        filename, content_type = f"{name}.tar.gz", 'application/gzip'
+    response = StreamingHttpResponse(output, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def docker_container_file_upload(request, container_id):
+    """Returns the URL the browser streams the file to; see uploads.container_files."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    path = _container_path(request.GET.get('path', '/'))
+    name = posixpath.basename(request.GET.get('name', ''))
+    upload_url = uploads.create_ticket('container_files', container_id=container_id, path=path, name=name)
+    return JsonResponse({'upload_url': upload_url})
+
+@login_required
+async def docker_image_action(request, image_id, action):
     try:
-        client = DockerCLI()
         if action == 'remove':
-            client.images.remove(image_id, force=True)
+            await aio.docker('rmi', '--force', image_id)
         elif action == 'pull':
             image_name = request.POST.get('image_name')
             registry_id = request.POST.get('registry_id')
             
             auth_config = None
             if registry_id and not str(registry_id).startswith('sys_'):
-                registry = get_object_or_404(DockerRegistry, id=registry_id)
+                registry = await aget_object_or_404(DockerRegistry, id=registry_id)
                 if registry.username and registry.password:
                     auth_config = {'username': registry.username, 'password': registry.password}
             
             if image_name:
-                if ':' in image_name:
+                if ':' in image_name.rsplit('/', 1)[-1]:
                     repository, tag = image_name.rsplit(':', 1)
                 else:
                     repository, tag = image_name, 'latest'
                 
-                client.images.pull(repository, tag=tag, auth_config=auth_config)
+                # The pull finishes even if the browser or a proxy stops waiting for it
+                await aio.detached(aio.pull(f"{repository}:{tag}", auth_config=auth_config))
     except Exception as e:
         print(f"Docker image action error: {e}")
     return redirect('/tool/docker/?tab=images')
@@ -210,6 +344,84 @@ def docker_registry_delete(request, registry_id):
     registry.delete()
     return redirect('/tool/docker/?tab=images')
 
+@login_required
+def docker_registry_browse(request, registry_id):
+    registry = get_object_or_404(DockerRegistry, id=registry_id)
+    repository = request.GET.get('repository')
+    tag = request.GET.get('tag')
+    context = {'registry': registry, 'repository': repository, 'tag': tag}
+    try:
+        client = RegistryClient.for_registry(registry)
+        if repository and tag:
+            context['manifest'] = client.manifest(repository, tag)
+        if repository:
+            context['tags'] = client.tags(repository)
+            context['image_name'] = client.image_name(repository)
+        else:
+            context['repositories'] = client.catalog()
+    except (RegistryError, ValueError) as e:
+        context['registry_error'] = str(e)
+    except Exception as e:
+        context['registry_error'] = f"Registry unreachable: {e}"
+    return render(request, 'core/partials/docker_registry_browser.html', context)
+
+@login_required
+def docker_image_suggest(request):
+    query = request.GET.get('image_name', '').strip()
+    suggestions = suggest_images(DockerRegistry.objects.all(), query) if query else []
+    return render(request, 'core/partials/docker_image_suggestions.html', {'suggestions': suggestions})
+
+@login_required
+def docker_image_check_updates(request):
+    if request.method == 'POST':
+        # Drop the schedule marker so the check starts now instead of at the next interval
+        cache.delete('docker_job:image-updates')
+        # A manual check must not be answered from the digest cache
+        run_periodically('image-updates', updates.CHECK_INTERVAL, updates.run_update_check, refresh=True)
+    return redirect('/tool/docker/?tab=images')
+
+@login_required
+async def docker_image_save(request):
+    """Streams `docker save` of the selected images as a tar, tar.gz or tar.zst download."""
+    # Each checkbox sends every tag of its image, space separated, so the archive keeps them all
+    selected = [value.split() for value in request.GET.getlist('images') if value.strip()]
+    images = [name for names in selected for name in names]
+    fmt = request.GET.get('format', 'tar')
+    if not images:
+        return redirect('/tool/docker/?tab=images')
+    if fmt not in imagearchive.available_formats():
+        return HttpResponse(f"Unsupported archive format: {fmt}", status=400)
+    try:
+        # Fail before the download starts; once streaming, errors can only truncate the file
+        await aio.docker('image', 'inspect', *images)
+    except aio.CommandError as e:
+        return HttpResponse(f"Image not found: {e.output}", status=404)
+    progress = await sync_to_async(streams.TransferProgress)('save', ', '.join(images))
+    output = imagearchive.save_output(images, fmt, progress)
+    error = await output.start()
+    if error:
+        await progress.aupdate(state='error', error=error, finished=time.time())
+        return HttpResponse(error, status=500, content_type='text/plain')
+    response = StreamingHttpResponse(output, content_type=imagearchive.ARCHIVE_FORMATS[fmt][0])
+    response['Content-Disposition'] = f'attachment; filename="{imagearchive.archive_name([names[0] for names in selected], fmt)}"'
+    return response
+
+@login_required
+def docker_image_load(request):
+    """Returns the URL the browser streams an image archive to; see uploads.image_load."""
+    if request.method != 'POST':
+        return redirect('/tool/docker/?tab=images')
+    return JsonResponse({'upload_url': uploads.create_ticket('image_load', name=request.GET.get('name') or 'upload')})
+
+@login_required
+def docker_image_transfers(request):
+    transfers = imagearchive.list_transfers()
+    context = {
+        'image_transfers': transfers,
+        'transfers_active': any(t['state'] in ('queued', 'running') for t in transfers),
+    }
+    return render(request, 'core/partials/docker_image_transfers.html', context)
+
 @login_required
 def docker_network_action(request, network_id, action):
     try:
@@ -247,6 +459,79 @@ def docker_volume_action(request, volume_name, action):
         print(f"Error removing volume {volume_name}: {e}")
     return redirect('/tool/docker/?tab=volumes')
 
+def _existing_volumes(names):
+    """Keeps the names `docker volume ls` reports; anything else must not reach a -v argument."""
+    existing = {volume.name for volume in DockerCLI().volumes.list()}
+    return [name for name in names if name in existing]
+
+@login_required
+async def docker_volume_backup(request, volume_name):
+    if request.method != 'POST':
+        return redirect('/tool/docker/?tab=volumes')
+    if not await sync_to_async(_existing_volumes)([volume_name]):
+        raise Http404(f"No such volume: {volume_name}")
+    if request.POST.get('target') == 'download':
+        progress = await sync_to_async(streams.TransferProgress)('backup', volume_name)
+        output = backups.download_output(volume_name, progress)
+        error = await output.start()
+        if error:
+            await progress.aupdate(state='error', error=error, finished=time.time())
+            return HttpResponse(error, status=500, content_type='text/plain')
+        response = StreamingHttpResponse(output, content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="{volume_name}{backups.BACKUP_SUFFIX}"'
+        return response
+    await sync_to_async(backups.submit_backup)(volume_name)
+    return redirect('/tool/docker/?tab=volumes')
+
+@login_required
+def docker_volume_backup_many(request):
+    if request.method == 'POST':
+        for volume_name in _existing_volumes(request.POST.getlist('volumes')):
+            backups.submit_backup(volume_name)
+    return redirect('/tool/docker/?tab=volumes')
+
+@login_required
+def docker_volume_restore(request, volume_name):
+    """Restores a volume from a server-side backup (`backup` form field).
+
+    With `upload` set, returns the URL the browser streams a .tar.gz to
+    instead; see uploads.volume_restore.
+    """
+    if request.method != 'POST':
+        return redirect('/tool/docker/?tab=volumes')
+    if not _existing_volumes([volume_name]):
+        raise Http404(f"No such volume: {volume_name}")
+    if request.POST.get('upload'):
+        return JsonResponse({'upload_url': uploads.create_ticket('volume_restore', volume=volume_name)})
+    backup = request.POST.get('backup')
+    if backup:
+        backups.submit_restore(volume_name, backup)
+    return redirect('/tool/docker/?tab=volumes')
+
+@login_required
+def docker_volume_backups(request):
+    jobs = backups.list_jobs()
+    context = {
+        'backup_jobs': jobs,
+        'backup_files': backups.list_backups(),
+        'backups_active': any(job['state'] in ('queued', 'running') for job in jobs),
+    }
+    return render(request, 'core/partials/docker_volume_backups.html', context)
+
+@login_required
+def docker_volume_backup_file(request, filename, action):
+    try:
+        path = backups.backup_path(filename)
+    except ValueError as e:
+        raise Http404(str(e))
+    if action == 'download':
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
+    if action == 'delete' and request.method == 'POST':
+        os.remove(path)
+        if os.path.exists(path + '.sha256'):
+            os.remove(path + '.sha256')
+    return redirect('/tool/docker/?tab=volumes')
+
 @login_required
 def docker_volume_create(request):
     if request.method == 'POST':